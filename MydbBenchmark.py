@@ -0,0 +1,829 @@
+import re
+import os
+import io
+import sys
+import csv
+import json
+import math
+import time
+import bisect
+import random
+import shutil
+import platform
+import multiprocessing
+import itertools
+import argparse
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import Mydb
+import MydbCatalog
+import MydbOrderby
+import MydbResultCache
+import MydbVector
+import MydbWal
+import MydbZonemap
+
+
+def generate_employees(filename, rows, seed=0):
+    rng = random.Random(seed)
+    departments = ["HR", "Sales", "IT", "Marketing", "Finance"]
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "name", "department", "salary"])
+        for i in range(1, rows + 1):
+            writer.writerow([i, f"emp{i}", rng.choice(departments), rng.randint(30000, 150000)])
+
+
+def generate_student(filename, rows, key_range, seed=1, skew=0.0, distribution='hotspot'):
+    # id is drawn from 1..key_range by key_sampler
+    rng = random.Random(seed)
+    sample = key_sampler(distribution, key_range, skew, rng)
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "name", "age"])
+        for i in range(rows):
+            writer.writerow([sample(), f"student{i}", rng.randint(18, 40)])
+
+
+def generate_books(filename, rows, seed=2, skew=0.0, distribution='uniform'):
+    # Shaped like Books.csv; authors and publishers are drawn by key_sampler, so a
+    # skewed distribution makes a few of them hold most of the books
+    rng = random.Random(seed)
+    authors = key_sampler(distribution, max(1, rows // 10), skew, rng)
+    publishers = key_sampler(distribution, max(1, min(1000, rows // 100)), skew, rng)
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["ISBN", "Book-Title", "Book-Author", "Year-Of-Publication", "Publisher"])
+        for i in range(rows):
+            writer.writerow([f"{i:010d}", f"Title {i}", f"Author {authors()}", rng.randint(1950, 2024),
+                             f"Publisher {publishers()}"])
+
+
+# Ranks a zipf sampler draws from; keys past it are never drawn
+ZIPF_MAX_RANKS = 1 << 20
+
+
+def key_sampler(distribution, key_range, skew, rng):
+    # Function drawing keys from 1..key_range:
+    #   uniform  every key equally likely
+    #   hotspot  a skew fraction of draws is key 1, the rest uniform
+    #   zipf     key k with probability proportional to 1 / k**skew
+    if distribution == 'uniform':
+        return lambda: rng.randint(1, key_range)
+    if distribution == 'hotspot':
+        return lambda: 1 if rng.random() < skew else rng.randint(1, key_range)
+    if distribution == 'zipf':
+        weights = itertools.accumulate(1 / rank ** skew for rank in range(1, min(key_range, ZIPF_MAX_RANKS) + 1))
+        cumulative = list(weights)
+        return lambda: bisect.bisect_left(cumulative, rng.random() * cumulative[-1]) + 1
+    raise ValueError(f"Unknown key distribution: {distribution}")
+
+
+def read_sorted_rows(filename):
+    if not os.path.exists(filename):
+        return None, []
+    with open(filename, 'r', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        return header, sorted(reader)
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    return time.perf_counter() - start
+
+
+def bench_join(employee_rows, student_rows, where_clause=None, memory_budget=4096, skew=0.0, nested_loop=True):
+    # Compares the hash joins and the join the planner picks with the original
+    # nested-loop join on synthetic tables
+    generate_employees("employees.csv", employee_rows)
+    generate_student("student.csv", student_rows, employee_rows, skew=skew)
+    condition = "student.id==employees.id"
+    args = (["id"], "student", "employees", condition, ["id"], where_clause)
+    joins = [("hash", Mydb.perform_hash_join, args),
+             ("grace", Mydb.perform_grace_hash_join, args + (memory_budget,)),
+             ("planned", Mydb.perform_join, args + (10, memory_budget))]
+    if nested_loop:
+        joins.insert(0, ("nested_loop", Mydb.perform_nested_loop_join, args))
+    # The planner's statistics are gathered once per table, outside the timings
+    MydbCatalog.table_stats("employees.csv")
+    MydbCatalog.table_stats("student.csv")
+    results = {}
+    for name, func, func_args in joins:
+        elapsed = time_call(func, *func_args)
+        results[name] = (elapsed, read_sorted_rows("student_employees.csv"))
+
+    outputs = [output for _, output in results.values()]
+    same = all(output == outputs[0] for output in outputs)
+    baseline = joins[0][0]
+    print(f"join employees={employee_rows} student={student_rows} where={where_clause!r} "
+          f"skew={skew} output_rows={len(outputs[0][1])}")
+    for name, (elapsed, _) in results.items():
+        print(f"  {name:12s} {elapsed:9.3f}s  {results[baseline][0] / elapsed:7.1f}x vs {baseline}")
+    print(f"  identical_output={same}")
+    return same
+
+
+def legacy_parse_conditions(where_clause):
+    # parse_conditions as it was before where clauses were compiled, kept as a baseline
+    tokens = re.split(r'(\(|\)|AND|OR|==|>|<|!=|<=|>=)', where_clause)
+    tokens = [token.strip() for token in tokens if token.strip()]
+
+    tks = tokens.copy()
+    tks_stack = []
+    while tks:
+        token = tks.pop()
+        if token == ')':
+            temp_stack = []
+            while len(tks)>1 and tks[-1] != '(':
+                temp_stack.append(tks.pop())
+            tks_stack.append(temp_stack[::-1])
+            tks.pop()
+        else:
+            tks_stack.append(token)
+    return None if not tks_stack else tks_stack[::-1]
+
+
+def legacy_evaluate_conditions(item, conditions):
+    # Per-row interpreter that compile_conditions replaced, kept as a baseline
+    def evaluate_condition(condition):
+        field, operator, value = condition
+        field = field.strip('()')
+        value = value.strip('()')
+        if not item[field]:
+            item[field] = '0' if operator == '==' else 0
+        if operator == '>':
+            return int(item[field]) > int(value)
+        elif operator == '<':
+            return int(item[field]) < int(value)
+        elif operator == '>=':
+            return int(item[field]) >= int(value)
+        elif operator == '<=':
+            return int(item[field]) <= int(value)
+        elif operator == '==':
+            return str(item[field]) == value
+        raise ValueError(f"Unsupported operator: {operator}")
+
+    def recursive_eval(conds):
+        if not conds:
+            return True
+        if 'AND' in conds or 'OR' in conds:
+            for idx, val in enumerate(conds):
+                if val in ['AND', 'OR']:
+                    left, right = conds[:idx], conds[idx+1:]
+                    left_result = recursive_eval(left[0] if type(left[0]) == list else left)
+                    right_result = recursive_eval(right[0] if type(right[0]) == list else right)
+                    return left_result and right_result if val == 'AND' else left_result or right_result
+        return evaluate_condition(conds)
+
+    return recursive_eval(conditions)
+
+
+def legacy_hash_join(table1, table2, key1, key2, where_clause, join_file):
+    # hash_join_rows as it was with a dict per row, kept as a baseline
+    where_predicate = Mydb.compile_conditions(Mydb.parse_conditions(where_clause)[0]) if where_clause else None
+    hash_table = {}
+    with open(table1 + ".csv", 'r', newline='') as file:
+        for row in csv.DictReader(file):
+            hash_table.setdefault(row[key1], []).append(Mydb.prefix_row_keys(row, table1))
+    with open(table2 + ".csv", 'r', newline='') as file, Mydb.BufferedCsvWriter(join_file) as sink:
+        for row in csv.DictReader(file):
+            matches = hash_table.get(row[key2])
+            if not matches:
+                continue
+            probe_row = Mydb.prefix_row_keys(row, table2)
+            for build_row in matches:
+                joined_row = build_row | probe_row
+                if where_predicate is None or where_predicate(joined_row):
+                    print("Joined", joined_row)
+                    sink.writerow(joined_row)
+
+
+def measure(func, *args):
+    # (CPU seconds, peak bytes allocated by Python) of one call
+    start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    elapsed = time.process_time() - start
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_positional(rows):
+    # Dict-per-row access (csv.DictReader) against positional rows with the column
+    # positions resolved once, for a filtered scan and a hash join
+    generate_employees("employees.csv", rows)
+    generate_student("student.csv", rows, rows)
+    where_clause = "salary>100000"
+    conditions = Mydb.parse_conditions(where_clause)[0]
+    header = Mydb.read_header("employees.csv")
+
+    def dict_scan():
+        predicate = Mydb.compile_conditions(conditions)
+        with open("employees.csv", 'r', newline='') as file:
+            return sum(1 for row in csv.DictReader(file) if predicate(row))
+
+    def positional_scan():
+        predicate = Mydb.compile_conditions(conditions, header)
+        return sum(1 for row in Mydb.scan_table("employees.csv") if predicate(row))
+
+    join_args = ("student", "employees", "id", "id", "student.age>30")
+    cases = [("scan", (dict_scan,), (positional_scan,)),
+             ("hash join", (legacy_hash_join,) + join_args + ("legacy_join.csv",),
+              (Mydb.perform_hash_join, ["id"], "student", "employees", "student.id==employees.id", ["id"], "student.age>30"))]
+    print(f"positional rows={rows}")
+    for name, legacy, current in cases:
+        legacy_cpu, legacy_peak = measure(*legacy)
+        cpu, peak = measure(*current)
+        print(f"  {name:10s} dict {legacy_cpu / rows * 1e6:6.2f}us/row {legacy_peak / 1024:9,.0f}KB peak  "
+              f"positional {cpu / rows * 1e6:6.2f}us/row {peak / 1024:9,.0f}KB peak  {legacy_cpu / cpu:5.1f}x cpu")
+    same = read_sorted_rows("legacy_join.csv") == read_sorted_rows("student_employees.csv")
+    print(f"  identical_output={same}")
+    os.remove("legacy_join.csv")
+    return same
+
+
+def bench_filter(rows, where_clause):
+    # Filtering throughput of the compiled predicate against the legacy interpreter
+    generate_employees("employees.csv", rows)
+    with open("employees.csv", 'r', newline='') as file:
+        table = list(csv.DictReader(file))
+
+    start = time.perf_counter()
+    conditions = legacy_parse_conditions(where_clause)
+    legacy_matches = sum(1 for row in table if legacy_evaluate_conditions(row, conditions))
+    legacy_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predicate = Mydb.compile_conditions(Mydb.parse_conditions(where_clause)[0])
+    compiled_matches = sum(1 for row in table if predicate(row))
+    compiled_elapsed = time.perf_counter() - start
+
+    print(f"filter rows={rows} where={where_clause!r} matches={compiled_matches}")
+    print(f"  legacy       {rows / legacy_elapsed:12,.0f} rows/s")
+    print(f"  compiled     {rows / compiled_elapsed:12,.0f} rows/s  {legacy_elapsed / compiled_elapsed:7.1f}x")
+    print(f"  identical_output={legacy_matches == compiled_matches}")
+    return legacy_matches == compiled_matches
+
+
+def bench_index(rows, lookups=20):
+    # Point and range lookups through a secondary index against full scans
+    # The where clauses are on salary, which is not in table order, so the scans
+    # cannot skip blocks through the zone map
+    generate_employees("employees.csv", rows)
+    MydbZonemap.load_zonemap("employees.csv")
+    rng = random.Random(2)
+    clauses = {"salary=={}": [rng.randint(30000, 150000) for _ in range(lookups)],
+               "salary>{}": [149990] * lookups}
+    commands = {clause: ["select id,name from employees where " + clause.format(key) for key in keys]
+                for clause, keys in clauses.items()}
+    scans = {clause: sum(time_call(Mydb.process_command, command) for command in commands[clause])
+             for clause in clauses}
+    build_time = time_call(Mydb.process_command, "create_index employees salary")
+    print(f"index rows={rows} create_index={build_time:.3f}s")
+    for clause in clauses:
+        scan = scans[clause]
+        indexed = sum(time_call(Mydb.process_command, command) for command in commands[clause])
+        print(f"  {clause:12s} scan {scan / lookups * 1000:9.2f}ms  index {indexed / lookups * 1000:9.2f}ms"
+              f"  {scan / indexed:7.1f}x")
+    os.remove("employees.salary.idx")
+
+
+def bench_prepared(rows, lookups=2000):
+    # Indexed point lookups sent as selects with a different id each time, so each is
+    # parsed, against one prepared statement executed with those ids
+    generate_employees("employees.csv", rows)
+    Mydb.process_command("create_index employees id")
+    rng = random.Random(3)
+    keys = [rng.randint(1, rows) for _ in range(lookups)]
+    # Loads the index and the zone map before timing
+    time_call(Mydb.process_command, "select id,name from employees where id==1")
+    parsed = sum(time_call(Mydb.process_command, f"select id,name from employees where id=={key}") for key in keys)
+    Mydb.process_command("prepare by_id as select id,name from employees where id==?")
+    prepared = sum(time_call(Mydb.process_command, f"execute by_id {key}") for key in keys)
+    parse = time_call(lambda: [Mydb.parse_select(f"id,name from employees where id=={key}") for key in keys])
+    print(f"prepared rows={rows} lookups={lookups}")
+    print(f"  select   {parsed / lookups * 1e6:9.1f}us/query  (parsing {parse / lookups * 1e6:.1f}us)")
+    print(f"  execute  {prepared / lookups * 1e6:9.1f}us/query  {parsed / prepared:7.2f}x")
+    os.remove("employees.id.idx")
+
+
+def bench_result_cache(rows, repeats=20):
+    # Dashboard queries run over and over, without and with the result cache; an
+    # insert before the last round makes each query miss once
+    generate_employees("employees.csv", rows)
+    queries = ["select department,COUNT(),AVG(salary) from employees group_by department",
+               "select id,name from employees where salary>149000"]
+    uncached = sum(time_call(Mydb.process_command, query) for _ in range(repeats) for query in queries)
+    MydbResultCache.clear_result_cache()
+    MydbResultCache.enable_result_cache(64 * 1024 * 1024)
+    try:
+        cached = sum(time_call(Mydb.process_command, query) for _ in range(repeats - 1) for query in queries)
+        Mydb.process_command("insert_into employees id=0,name=new,department=HR,salary=149500")
+        cached += sum(time_call(Mydb.process_command, query) for query in queries)
+        stats = MydbResultCache.result_cache_stats()
+    finally:
+        MydbResultCache.enable_result_cache(0)
+    runs = repeats * len(queries)
+    print(f"result cache rows={rows} runs={runs}")
+    print(f"  uncached {uncached / runs * 1000:9.2f}ms/query  cached {cached / runs * 1000:9.2f}ms/query"
+          f"  {uncached / cached:7.1f}x  hits={stats['hits']} misses={stats['misses']}")
+
+
+def bench_zonemap(rows, repeats=5):
+    # Selective where clauses with block skipping against reading every block
+    generate_employees("employees.csv", rows)
+    build_time = time_call(MydbZonemap.build_zonemap, "employees.csv")
+    size = os.path.getsize("employees.csv")
+    print(f"zonemap rows={rows} build={build_time:.3f}s")
+    for where_clause in [f"id>{rows - 100}", f"id>={rows // 2} AND id<{rows // 2 + 50}", "salary>149900"]:
+        conditions = Mydb.parse_conditions(where_clause)[0]
+        predicate = Mydb.compile_conditions(conditions, Mydb.read_header("employees.csv"))
+        read = sum(end - start for start, end in MydbZonemap.candidate_ranges("employees.csv", conditions))
+        full = sum(time_call(lambda: [row for row in Mydb.scan_table("employees.csv") if predicate(row)])
+                   for _ in range(repeats))
+        skipped = sum(time_call(lambda: [row for row in Mydb.scan_table("employees.csv", conditions) if predicate(row)])
+                      for _ in range(repeats))
+        print(f"  {where_clause:28s} full {full / repeats * 1000:8.2f}ms  zonemap {skipped / repeats * 1000:8.2f}ms"
+              f"  {full / skipped:7.1f}x  read {read / size:6.1%}")
+    os.remove("employees.zonemap")
+
+
+def bench_parallel(rows, max_workers):
+    # select and group_by throughput from one worker process up to max_workers
+    generate_employees("employees.csv", rows)
+    MydbZonemap.load_zonemap("employees.csv")
+    conditions = Mydb.parse_conditions("salary>100000")[0]
+    counts = sorted({1, max_workers} | {n for n in (2, 4, 8, 16, 32) if n < max_workers})
+    print(f"parallel rows={rows} cpus={os.cpu_count()}")
+    baseline = {}
+    for workers in counts:
+        for name, func, args in [
+                ("select", Mydb.execute_query, ("employees.csv", ["id"], conditions, None, 10000, workers)),
+                ("group_by", Mydb.perform_groupBy, ("employees.csv", ["department"], [("SUM", "salary"), ("COUNT", None)], 10000, None, workers))]:
+            elapsed = time_call(func, *args)
+            baseline.setdefault(name, elapsed)
+            print(f"  {name:8s} workers={workers:<3d} {elapsed:7.3f}s {rows / elapsed:12,.0f} rows/s"
+                  f"  {baseline[name] / elapsed:5.2f}x")
+    os.remove("employees.zonemap")
+
+
+def bench_columnar(rows):
+    # Scans touching two of the employee columns, row-oriented CSV against columnar
+    generate_employees("employees.csv", rows)
+    conditions = Mydb.parse_conditions("salary>140000")[0]
+    print(f"columnar rows={rows}")
+    timings, sizes = {}, {}
+    for layout in ("csv", "columnar"):
+        if layout == "columnar":
+            Mydb.process_command("convert employees columnar")
+        sizes[layout] = Mydb.table_bytes("employees.csv")
+        timings[layout] = (
+            time_call(Mydb.perform_groupBy, "employees.csv", ["department"], [("SUM", "salary")], 10000, None, 1),
+            time_call(lambda: Mydb.query("employees.csv", ["id"], conditions, 1).fetchall()))
+    for i, name in enumerate(("group_by", "select")):
+        print(f"  {name:8s} csv {timings['csv'][i]:7.3f}s  columnar {timings['columnar'][i]:7.3f}s"
+              f"  {timings['csv'][i] / timings['columnar'][i]:5.2f}x")
+    print(f"  size     csv {sizes['csv']:,} bytes  columnar {sizes['columnar']:,} bytes")
+    Mydb.process_command("convert employees csv")
+
+
+def bench_vectorized(rows):
+    # Filter and group_by on a numeric columnar table, row at a time against NumPy
+    if MydbVector.numpy is None:
+        print("vectorized: NumPy is not installed, skipped")
+        return
+    rng = random.Random(0)
+    Mydb.process_command("create_table numbers id,department,salary columnar")
+    Mydb.append_rows("numbers.csv", None, ([str(i), str(rng.randint(1, 20)), str(rng.randint(30000, 150000))]
+                                           for i in range(rows)))
+    conditions = Mydb.parse_conditions("salary>149000 AND department<=10")[0]
+    print(f"vectorized rows={rows}")
+    timings = {}
+    for vectorize in (False, True):
+        MydbVector.VECTORIZE = vectorize
+        timings[vectorize] = (
+            time_call(lambda: Mydb.query("numbers.csv", ["id"], conditions).fetchall()),
+            time_call(Mydb.perform_groupBy, "numbers.csv", ["department"], [("SUM", "salary"), ("MAX", "salary")], 10000))
+    MydbVector.VECTORIZE = True
+    for i, name in enumerate(("filter", "group_by")):
+        print(f"  {name:8s} rows {rows / timings[False][i]:12,.0f} rows/s  numpy {rows / timings[True][i]:12,.0f} rows/s"
+              f"  {timings[False][i] / timings[True][i]:6.1f}x")
+    shutil.rmtree("numbers.cols")
+
+
+def bench_sort(rows, memory_budget):
+    # ORDER_BY throughput fully in memory and with runs spilled under a memory budget
+    generate_employees("employees.csv", rows)
+    print(f"sort rows={rows}")
+    for budget in (None, memory_budget):
+        for order_by in (["salary", "DESC"], ["department,", "salary"]):
+            elapsed = time_call(MydbOrderby.execute_query, "employees.csv", ["id"], None, order_by, budget)
+            print(f"  budget={budget or 'default':>10} ORDER_BY {' '.join(order_by):18s} {elapsed:7.3f}s "
+                  f"{rows / elapsed:12,.0f} rows/s")
+    for limit in (10, 100):
+        elapsed = time_call(MydbOrderby.execute_query, "employees.csv", ["id"], None, ["salary", "DESC"], None, limit)
+        print(f"  top-{limit:<14d} ORDER_BY salary DESC        {elapsed:7.3f}s {rows / elapsed:12,.0f} rows/s")
+    os.remove("order_by_result.csv")
+
+
+def bench_typed(rows, repeats=3):
+    # Filter, group_by and ORDER_BY on float and text columns without and with column types
+    rng = random.Random(0)
+    data = [[str(i), f"emp{rng.randint(1, rows)}", rng.choice(["HR", "Sales", "IT"]), repr(rng.uniform(0, 100))]
+            for i in range(rows)]
+    print(f"typed rows={rows}")
+    timings = {}
+    for schema in ("id,name,department,score", "id:int,name:str,department:str,score:float"):
+        for path in ("scores.csv", "scores.zonemap"):
+            if os.path.exists(path):
+                os.remove(path)
+        Mydb.process_command(f"create_table scores {schema}")
+        Mydb.append_rows("scores.csv", Mydb.table_header("scores.csv"), data)
+        MydbZonemap.load_zonemap("scores.csv")
+        conditions = Mydb.parse_conditions("score>50.5 AND department==IT")[0]
+        timings[schema] = [min(time_call(*call) for _ in range(repeats)) for call in (
+            (lambda: Mydb.query("scores.csv", ["id"], conditions, 1).fetchall(),),
+            (Mydb.perform_groupBy, "scores.csv", ["department"], [("SUM", "score"), ("MAX", "score")], 10000, None, 1),
+            (MydbOrderby.execute_query, "scores.csv", ["id"], None, ["name", "DESC"]))]
+    untyped, typed = timings.values()
+    for i, name in enumerate(("filter", "group_by", "order_by")):
+        print(f"  {name:8s} untyped {untyped[i]:7.3f}s  typed {typed[i]:7.3f}s  {untyped[i] / typed[i]:5.2f}x")
+    os.remove("order_by_result.csv")
+
+
+def bench_delete(sizes, deletes=20):
+    # Cost of single-row deletes (through an index on id) as the table grows; with
+    # tombstones it stays flat, while compact rewrites the whole table once
+    print(f"delete deletes={deletes}")
+    for rows in sizes:
+        generate_employees("employees.csv", rows)
+        Mydb.process_command("create_index employees id")
+        Mydb.table_stats("employees.csv")
+        ids = random.Random(3).sample(range(1, rows + 1), deletes)
+        elapsed = sum(time_call(Mydb.process_command, f"delete from employees where id=={key}") for key in ids)
+        compact = time_call(Mydb.process_command, "compact employees")
+        print(f"  rows={rows:<9d} delete {elapsed / deletes * 1000:8.2f}ms  compact {compact * 1000:9.2f}ms")
+    os.remove("employees.id.idx")
+
+
+def bench_wal(rows, synced_rows=2000, batch_rows=100, threads=8):
+    # Durable insert_into rates: every insert_into returns once its log record is
+    # synced, so single-row inserts from one client pay an fsync each and multi-row
+    # ones share it. Appends from several threads at once share fsyncs by group
+    # commit. Then the time to replay the log after a crash.
+    print(f"wal rows={rows}")
+    for label, count, per_command in (("single-row", synced_rows, 1), ("multi-row", rows, batch_rows)):
+        Mydb.close_wal()
+        for path in ("events.csv", MydbWal.WAL_FILE):
+            if os.path.exists(path):
+                os.remove(path)
+        Mydb.process_command("create_table events id,name,value")
+        start = time.perf_counter()
+        for first in range(0, count, per_command):
+            Mydb.process_command("insert_into events " + ";".join(
+                f"id={i},name=event{i},value={i % 97}" for i in range(first, min(count, first + per_command))))
+        elapsed = time.perf_counter() - start
+        print(f"  {label:12s} {count / elapsed:12,.0f} rows/s  {Mydb.WAL.syncs:6d} fsyncs")
+
+    for writers in (1, threads):
+        log = MydbWal.WriteAheadLog("bench.wal")
+        count = synced_rows // writers
+
+        def append_records():
+            for i in range(count):
+                log.append({"op": "insert", "table": "events.csv", "rows": [[str(i), f"event{i}", str(i % 97)]]})
+
+        workers = [threading.Thread(target=append_records) for _ in range(writers)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        log.close()
+        os.remove("bench.wal")
+        print(f"  {writers:2d} threads   {count * writers / elapsed:12,.0f} appends/s  {log.syncs:6d} fsyncs")
+
+    # Crash: the log is synced but the buffered rows never reach the table
+    Mydb.WAL.close()
+    Mydb.WAL = None
+    Mydb.PENDING_INSERTS.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        recovery = time_call(Mydb.open_wal)
+    print(f"  replay       {recovery:12.3f}s")
+    Mydb.close_wal()
+    os.remove("events.csv")
+
+
+def bench_load(rows, single_rows=2000):
+    # Ingestion rate of bulk load against one insert_into per row
+    generate_employees("source.csv", rows)
+    with open("source.csv", 'r', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        commands = ["insert_into employees " + ",".join(f"{k}={v}" for k, v in zip(header, row))
+                    for row in itertools.islice(reader, single_rows)]
+
+    with open("employees.csv", 'w', newline='') as file:
+        csv.writer(file).writerow(header)
+    start = time.perf_counter()
+    for command in commands:
+        Mydb.process_command(command)
+    Mydb.checkpoint()
+    single = len(commands) / (time.perf_counter() - start)
+
+    with open("employees.csv", 'w', newline='') as file:
+        csv.writer(file).writerow(header)
+    elapsed = time_call(Mydb.process_command, "load employees source.csv")
+    print(f"load rows={rows}")
+    print(f"  insert_into  {single:12,.0f} rows/s")
+    print(f"  load         {rows / elapsed:12,.0f} rows/s  {rows / elapsed / single:7.1f}x")
+    os.remove("source.csv")
+
+
+def suite_workloads(args):
+    # (name, commands, table rows each command processes) of the scripted workloads,
+    # run in order against the generated tables. Commands starting with ORDER_BY go
+    # to MydbOrderby.process_command, the rest to Mydb.process_command.
+    rng = random.Random(args.seed)
+    sample = key_sampler(args.distribution, args.rows, args.skew, rng)
+    ops, scans = args.ops, args.scan_ops
+    rows, students, books = args.rows, args.student_rows, args.books_rows
+    return [
+        ("insert_into", [f"insert_into employees id={rows + i},name=emp{rows + i},department=IT,salary={30000 + i}"
+                         for i in range(1, ops + 1)] + ["commit"], 1),
+        ("select_point", [f"select id,name,salary from employees where id=={sample()}" for _ in range(ops)], 1),
+        ("select_range", [f"select id,name from employees where salary>{rng.randint(140000, 149000)}"
+                          for _ in range(scans)], rows),
+        ("select_books", [f"select ISBN,Book-Title from Books where Year-Of-Publication=={rng.randint(1950, 2024)}"
+                          for _ in range(scans)], books),
+        ("group_by", ["select department,COUNT(),AVG(salary),MAX(salary) from employees group_by department"] * scans,
+         rows),
+        ("group_by_books", ["select Publisher,COUNT() from Books group_by Publisher"] * scans, books),
+        ("join", ["select id,name from student join employees on student.id==employees.id"] * scans,
+         rows + students),
+        ("order_by", ["ORDER_BY select id,salary from employees ORDER_BY salary DESC LIMIT 100"] * scans, rows),
+        ("delete", [f"delete from employees where id=={sample()}" for _ in range(ops)], 1),
+        # Last, as every table it adds makes each later catalog update write more
+        ("create_table", [f"create_table bench{i} id:int,name,value:int" for i in range(ops)], 0),
+    ]
+
+
+def run_suite_command(command):
+    if command.startswith("ORDER_BY "):
+        return MydbOrderby.process_command(command[len("ORDER_BY "):])
+    return Mydb.process_command(command)
+
+
+def io_counters():
+    # (bytes read, bytes written) by this process so far, where the OS reports them
+    try:
+        with open("/proc/self/io", 'r') as file:
+            counters = dict(line.split(': ') for line in file.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def peak_rss_kb():
+    # Peak resident set of this process and its finished children
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an ascending list
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+
+def run_workload(commands, rows_per_command):
+    # Runs the commands one by one; throughput, latency percentiles (ms), peak RSS
+    # and bytes read/written of the whole workload
+    latencies = []
+    io_before = io_counters()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for command in commands:
+            began = time.perf_counter()
+            run_suite_command(command)
+            latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    io_after = io_counters()
+    Mydb.close_wal()
+    latencies.sort()
+    result = {"ops": len(commands), "seconds": elapsed,
+              "ops_per_sec": len(commands) / elapsed if elapsed else None,
+              "rows_per_sec": len(commands) * rows_per_command / elapsed if elapsed else None,
+              "latency_ms": {name: percentile(latencies, fraction) * 1000 for name, fraction in
+                             (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+              "peak_rss_kb": peak_rss_kb(),
+              "bytes_read": io_after[0] - io_before[0] if io_before and io_after else None,
+              "bytes_written": io_after[1] - io_before[1] if io_before and io_after else None}
+    return result
+
+
+def workload_process(connection, commands, rows_per_command):
+    # The catalog held in memory is the parent's; earlier workloads may have changed it on disk
+    MydbCatalog.CATALOG_LOADED = False
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        Mydb.open_wal()
+    try:
+        connection.send(run_workload(commands, rows_per_command))
+    finally:
+        connection.close()
+
+
+def isolated_workload(commands, rows_per_command):
+    # Runs the workload in a forked process so peak RSS and I/O are its own; in this
+    # process where fork is not available
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        return run_workload(commands, rows_per_command)
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=workload_process, args=(sender, commands, rows_per_command))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        raise RuntimeError("benchmark workload process failed") from None
+    process.join()
+    return result
+
+
+def run_suite(args):
+    # Generates the tables, runs every workload and returns the results as a dict
+    start = time.perf_counter()
+    generate_employees("employees.csv", args.rows, args.seed)
+    generate_student("student.csv", args.student_rows, args.rows, args.seed + 1, args.skew, args.distribution)
+    generate_books("Books.csv", args.books_rows, args.seed + 2, args.skew, args.distribution)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        Mydb.process_command("create_index employees id")
+        Mydb.close_wal()
+    # Catalog statistics and zone maps are built here rather than by the first workload
+    for filename in ("employees.csv", "student.csv", "Books.csv"):
+        Mydb.table_stats(filename)
+        MydbZonemap.load_zonemap(filename)
+    results = {"config": {"rows": args.rows, "student_rows": args.student_rows, "books_rows": args.books_rows,
+                          "distribution": args.distribution, "skew": args.skew, "seed": args.seed,
+                          "ops": args.ops, "scan_ops": args.scan_ops},
+               "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                               "cpus": os.cpu_count(), "numpy": MydbVector.VECTORIZE,
+                               "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+               "generate_seconds": time.perf_counter() - start,
+               "workloads": {}}
+    print(f"suite rows={args.rows} students={args.student_rows} books={args.books_rows} "
+          f"distribution={args.distribution} skew={args.skew}")
+    print(f"  {'workload':15s} {'ops/s':>10s} {'rows/s':>12s} {'p50 ms':>9s} {'p99 ms':>9s} "
+          f"{'peak RSS':>10s} {'read':>10s} {'written':>10s}")
+    for name, commands, rows_per_command in suite_workloads(args):
+        result = isolated_workload(commands, rows_per_command)
+        results["workloads"][name] = result
+        print(f"  {name:15s} {result['ops_per_sec']:10,.1f} {result['rows_per_sec']:12,.0f} "
+              f"{result['latency_ms']['p50']:9.2f} {result['latency_ms']['p99']:9.2f} "
+              f"{format_bytes(result['peak_rss_kb'] and result['peak_rss_kb'] * 1024):>10s} "
+              f"{format_bytes(result['bytes_read']):>10s} {format_bytes(result['bytes_written']):>10s}")
+    return results
+
+
+def format_bytes(count):
+    if count is None:
+        return "n/a"
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024 or unit == "GB":
+            return f"{count:.0f}{unit}" if unit == "B" else f"{count:.1f}{unit}"
+        count /= 1024
+
+
+def compare_results(baseline, current, threshold):
+    # Prints each workload's change against a saved run; returns the workloads whose
+    # throughput or p50 latency got worse by more than threshold (a fraction)
+    print(f"compared with {baseline['environment']['time']} (regression threshold {threshold:.0%})")
+    regressions = []
+    for name, result in current["workloads"].items():
+        old = baseline["workloads"].get(name)
+        if old is None or not old["ops_per_sec"] or not result["ops_per_sec"]:
+            continue
+        throughput = result["ops_per_sec"] / old["ops_per_sec"]
+        latency = result["latency_ms"]["p50"] / old["latency_ms"]["p50"] if old["latency_ms"]["p50"] else 1.0
+        regressed = throughput < 1 - threshold or latency > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(f"  {name:15s} throughput {throughput:6.2f}x  p50 {latency:6.2f}x{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def suite_main(args):
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            results = run_suite(args)
+        finally:
+            Mydb.close_wal()
+            os.chdir(cwd)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {output}")
+    if baseline is not None and compare_results(baseline, results, args.threshold):
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MyDB benchmarks")
+    parser.add_argument("--suite", action="store_true",
+                        help="run the scripted workload suite and save its results as JSON")
+    parser.add_argument("--rows", type=int, default=100000, help="suite: employees rows")
+    parser.add_argument("--student-rows", type=int, default=100000, help="suite: student rows")
+    parser.add_argument("--books-rows", type=int, default=100000, help="suite: Books rows")
+    parser.add_argument("--distribution", choices=("uniform", "zipf", "hotspot"), default="uniform",
+                        help="suite: distribution of join, lookup and delete keys")
+    parser.add_argument("--skew", type=float, default=0.0,
+                        help="suite: zipf exponent, or the hotspot fraction of draws that hit key 1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ops", type=int, default=1000, help="suite: commands per point workload")
+    parser.add_argument("--scan-ops", type=int, default=5, help="suite: commands per scan workload")
+    parser.add_argument("--output", default="mydb_bench.json", help="suite: JSON results file")
+    parser.add_argument("--compare", help="suite: earlier JSON results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="suite: slowdown counted as a regression, as a fraction")
+    parser.add_argument("--employees", type=int, default=2000)
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--filter-rows", type=int, default=200000)
+    parser.add_argument("--positional-rows", type=int, default=100000)
+    parser.add_argument("--index-rows", type=int, default=100000)
+    parser.add_argument("--prepared-rows", type=int, default=100000)
+    parser.add_argument("--result-cache-rows", type=int, default=200000)
+    parser.add_argument("--zonemap-rows", type=int, default=200000)
+    parser.add_argument("--sort-rows", type=int, default=200000)
+    parser.add_argument("--parallel-rows", type=int, default=500000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="largest worker count for the parallel scan benchmark")
+    parser.add_argument("--load-rows", type=int, default=200000)
+    parser.add_argument("--columnar-rows", type=int, default=200000)
+    parser.add_argument("--vectorized-rows", type=int, default=1000000)
+    parser.add_argument("--typed-rows", type=int, default=200000)
+    parser.add_argument("--delete-rows", type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument("--wal-rows", type=int, default=100000)
+    parser.add_argument("--memory-budget", type=int, default=16384,
+                        help="bytes the grace hash join may hold in memory")
+    args = parser.parse_args()
+    if args.suite:
+        suite_main(args)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            bench_join(args.employees, args.students, memory_budget=args.memory_budget)
+            bench_join(args.employees, args.students, "student.age>25", memory_budget=args.memory_budget)
+            bench_join(args.employees, args.students, memory_budget=args.memory_budget, skew=0.9, nested_loop=False)
+            bench_index(args.index_rows)
+            bench_prepared(args.prepared_rows)
+            bench_result_cache(args.result_cache_rows)
+            bench_zonemap(args.zonemap_rows)
+            bench_parallel(args.parallel_rows, args.workers)
+            bench_load(args.load_rows)
+            bench_wal(args.wal_rows)
+            bench_columnar(args.columnar_rows)
+            bench_vectorized(args.vectorized_rows)
+            bench_typed(args.typed_rows)
+            bench_delete(args.delete_rows)
+            bench_sort(args.sort_rows, 4 * 1024 * 1024)
+            bench_positional(args.positional_rows)
+            bench_filter(args.filter_rows, "id>1000")
+            bench_filter(args.filter_rows, "(department==HR AND salary>60000) OR (id<500 AND department==IT)")
+        finally:
+            Mydb.close_wal()
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
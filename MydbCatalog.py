@@ -0,0 +1,284 @@
+import re
+import os
+import csv
+import json
+import math
+import base64
+import hashlib
+from operator import le
+
+from MydbZonemap import read_ranges
+from MydbTombstone import dead_spans, live_ranges, data_range
+
+# Table catalog: schema, exact row count, byte size and per-column statistics for
+# every table, held in CATALOG and persisted to CATALOG_FILE. The schema is the
+# list of columns plus, for tables created with typed columns (id:int), a map of
+# column -> type that survives re-analyzing the table. A table is analyzed
+# (scanned once) the first time it is used or when its file was changed outside
+# MyDB; after that insert_into, load and delete keep the entry up to date.
+#
+# Column statistics: nulls (empty cells), non_numeric (cells that are not
+# numbers), num_min/num_max over numeric cells, str_min/str_max over all
+# non-empty cells, ascending (every non-empty cell is a number and they never
+# decrease in file order) and a HyperLogLog sketch for the approximate distinct count.
+# Deletes keep row and null counts exact; min/max and distinct counts then
+# become bounds until the table is analyzed again.
+
+CATALOG_FILE = 'catalog.json'
+CATALOG = {}
+CATALOG_LOADED = False
+
+# HyperLogLog with 2**HLL_BITS registers, about 3% standard error
+HLL_BITS = 10
+HLL_REGISTERS = 1 << HLL_BITS
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+HLL_REMAINING_BITS = 32 - HLL_BITS
+HLL_REMAINING_MASK = (1 << HLL_REMAINING_BITS) - 1
+NONZERO_REGISTER = re.compile(b'[^\\x00]')
+
+
+def load_catalog():
+    global CATALOG_LOADED
+    if CATALOG_LOADED:
+        return CATALOG
+    CATALOG.clear()
+    if os.path.exists(CATALOG_FILE):
+        with open(CATALOG_FILE, 'r') as file:
+            for filename, entry in json.load(file).items():
+                for stats in entry["stats"].values():
+                    stats["hll"] = bytearray(base64.b64decode(stats["hll"]))
+                CATALOG[filename] = entry
+    CATALOG_LOADED = True
+    return CATALOG
+
+
+def save_catalog():
+    data = {}
+    for filename, entry in CATALOG.items():
+        stats = {column: dict(values, hll=base64.b64encode(bytes(values["hll"])).decode('ascii'))
+                 for column, values in entry["stats"].items()}
+        data[filename] = dict(entry, stats=stats)
+    with open(CATALOG_FILE + '.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(CATALOG_FILE + '.tmp', CATALOG_FILE)
+
+
+def new_column_stats():
+    return {"nulls": 0, "non_numeric": 0, "num_min": None, "num_max": None,
+            "str_min": None, "str_max": None, "ascending": True, "hll": bytearray(HLL_REGISTERS)}
+
+
+def new_table_stats(columns):
+    return {"columns": list(columns), "rows": 0, "bytes": 0, "mtime_ns": 0,
+            "stats": {column: new_column_stats() for column in columns}}
+
+
+def hash_value(value):
+    # 32-bit hash that is stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=4).digest(), 'big')
+
+
+def observe_rows(table, rows, batch_size=4096):
+    # Updates table statistics with rows (lists in column order), yielding each row
+    # so the caller can write it in the same pass. Rows are observed in batches so the
+    # per-column work runs through min/max/map over whole columns.
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            observe_batch(table, batch)
+            yield from batch
+            batch = []
+    if batch:
+        observe_batch(table, batch)
+        yield from batch
+
+
+def observe_batch(table, batch):
+    table["rows"] += len(batch)
+    width = len(table["columns"])
+    padded = [row if len(row) >= width else list(row) + [''] * (width - len(row)) for row in batch]
+    for column, cells in zip(table["columns"], zip(*padded)):
+        stats = table["stats"][column]
+        values = [value for value in cells if value]
+        stats["nulls"] += len(cells) - len(values)
+        if not values:
+            continue
+        update_range(stats, "str_min", "str_max", min(values), max(values))
+        numbers, non_numeric = parse_numbers(values)
+        stats["non_numeric"] += non_numeric
+        stats["ascending"] = (stats.get("ascending", False) and not non_numeric
+                              and (stats["num_max"] is None or numbers[0] >= stats["num_max"])
+                              and all(map(le, numbers, numbers[1:])))
+        if numbers:
+            update_range(stats, "num_min", "num_max", min(numbers), max(numbers))
+        hll = stats["hll"]
+        for value in set(values):
+            h = hash_value(value)
+            register = h >> HLL_REMAINING_BITS
+            rank = HLL_REMAINING_BITS - (h & HLL_REMAINING_MASK).bit_length() + 1
+            if rank > hll[register]:
+                hll[register] = rank
+
+
+def update_range(stats, min_key, max_key, low, high):
+    if stats[min_key] is None or low < stats[min_key]:
+        stats[min_key] = low
+    if stats[max_key] is None or high > stats[max_key]:
+        stats[max_key] = high
+
+
+def parse_numbers(values):
+    # (numeric values, count of non-numeric values); 'nan' counts as non-numeric
+    try:
+        return list(map(int, values)), 0
+    except ValueError:
+        pass
+    try:
+        numbers = list(map(float, values))
+        finite = [number for number in numbers if number == number]
+        return finite, len(numbers) - len(finite)
+    except ValueError:
+        pass
+    numbers = []
+    for value in values:
+        try:
+            number = float(value)
+        except ValueError:
+            continue
+        if number == number:
+            numbers.append(int(value) if number.is_integer() and value.lstrip('+-').isdigit() else number)
+    return numbers, len(values) - len(numbers)
+
+
+def merge_table_stats(table, delta):
+    # Folds the statistics of appended rows into the table entry
+    table["rows"] += delta["rows"]
+    for column, extra in delta["stats"].items():
+        stats = table["stats"][column]
+        stats["nulls"] += extra["nulls"]
+        stats["non_numeric"] += extra["non_numeric"]
+        stats["ascending"] = (stats.get("ascending", False) and extra["ascending"] and
+                              (extra["num_min"] is None or stats["num_max"] is None or extra["num_min"] >= stats["num_max"]))
+        for key, pick in (("num_min", min), ("num_max", max), ("str_min", min), ("str_max", max)):
+            if extra[key] is not None:
+                stats[key] = extra[key] if stats[key] is None else pick(stats[key], extra[key])
+        hll = stats["hll"]
+        for match in NONZERO_REGISTER.finditer(extra["hll"]):
+            register = match.start()
+            if extra["hll"][register] > hll[register]:
+                hll[register] = extra["hll"][register]
+
+
+def record_file_state(filename, table):
+    stat = os.stat(filename)
+    table["bytes"], table["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+
+
+def analyze_table(filename):
+    # Scans the table once and replaces its catalog entry, keeping the column types.
+    # Deleted rows are not counted.
+    with open(filename, 'r', newline='') as file:
+        reader = csv.reader(file)
+        table = new_table_stats(next(reader, []))
+        spans = dead_spans(filename)
+        if spans:
+            reader = read_ranges(filename, live_ranges([data_range(filename)], spans))
+        for _ in observe_rows(table, reader):
+            pass
+    record_file_state(filename, table)
+    old = load_catalog().get(filename)
+    if old is not None and old.get("schema"):
+        table["schema"] = {column: kind for column, kind in old["schema"].items() if column in table["columns"]}
+    load_catalog()[filename] = table
+    save_catalog()
+    return table
+
+
+def table_stats(filename):
+    # Catalog entry for filename, analyzing the table if it is unknown or was changed
+    # outside MyDB (its size or mtime no longer match)
+    table = load_catalog().get(filename)
+    if table is not None:
+        stat = os.stat(filename)
+        if (stat.st_size, stat.st_mtime_ns) == (table["bytes"], table["mtime_ns"]):
+            return table
+    return analyze_table(filename)
+
+
+def catalog_schema(filename):
+    # column -> type of the table's typed columns; only tables made by create_table have any
+    table = load_catalog().get(filename)
+    return table.get("schema", {}) if table else {}
+
+
+def catalog_create(filename, columns, schema=None):
+    table = new_table_stats(columns)
+    if schema:
+        table["schema"] = dict(schema)
+    record_file_state(filename, table)
+    load_catalog()[filename] = table
+    save_catalog()
+
+
+def catalog_append(filename, delta):
+    table = load_catalog().get(filename)
+    if table is None or table["columns"] != delta["columns"]:
+        analyze_table(filename)
+        return
+    merge_table_stats(table, delta)
+    record_file_state(filename, table)
+    save_catalog()
+
+
+def catalog_touch(filename):
+    # The table file was rewritten without changing its rows (compaction)
+    table = load_catalog().get(filename)
+    if table is None:
+        analyze_table(filename)
+        return
+    record_file_state(filename, table)
+    save_catalog()
+
+
+def catalog_remove(filename, deleted_rows, deleted_nulls):
+    # deleted_nulls maps column -> number of empty cells among the deleted rows
+    table = load_catalog().get(filename)
+    if table is None:
+        analyze_table(filename)
+        return
+    table["rows"] -= deleted_rows
+    for column, nulls in deleted_nulls.items():
+        if column in table["stats"]:
+            table["stats"][column]["nulls"] -= nulls
+    record_file_state(filename, table)
+    save_catalog()
+
+
+def catalog_set_schema(filename, schema):
+    table = table_stats(filename)
+    table["schema"] = dict(schema)
+    save_catalog()
+
+
+def catalog_drop(filename):
+    if load_catalog().pop(filename, None) is not None:
+        save_catalog()
+
+
+def column_range(filename, column):
+    # (min, max) of the column: numbers when every non-empty cell is numeric, else strings
+    stats = table_stats(filename)["stats"][column]
+    if stats["non_numeric"] == 0:
+        return stats["num_min"], stats["num_max"]
+    return stats["str_min"], stats["str_max"]
+
+
+def distinct_count(filename, column):
+    registers = table_stats(filename)["stats"][column]["hll"]
+    estimate = HLL_ALPHA * HLL_REGISTERS * HLL_REGISTERS / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * HLL_REGISTERS and zeros:
+        # Small range correction (linear counting)
+        estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+    return int(round(estimate))
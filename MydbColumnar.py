@@ -0,0 +1,331 @@
+import os
+import json
+import math
+import array
+import bisect
+import itertools
+
+from MydbTombstone import read_tombstones, add_tombstones, clear_tombstones, truncate_tombstones
+from MydbExplain import add_bytes_read
+
+# Columnar tables: <table>.cols/ holds header.json (column names, row count and the
+# encoding of each column) and one array file per column, named by column position:
+#   int    <i>.col  signed 64-bit integers; INT_NULL marks an empty cell
+#   float  <i>.col  doubles; NaN marks an empty cell
+#   dict   <i>.col  32-bit codes into the column's dictionary kept in header.json
+#   str    <i>.col  UTF-8 bytes of all values, <i>.off their end offsets (after a leading 0)
+# header.json also keeps the table's column types (id:int) as "schema"; "types"
+# are the encodings. Every cell reads back as exactly the text that was stored: a column is int or
+# float only while each value is the canonical text of its number, and a string
+# column stays dictionary encoded while it has at most DICT_MAX_ENTRIES values.
+# Columns only widen (int/float -> dict -> str); the column file is rewritten once
+# when they do. The row count in header.json is authoritative, so data past it
+# (left by an interrupted append) is ignored and cut off by the next append.
+# Deleted rows are listed by row number in the tombstone file DELETED_FILE until
+# the table is compacted.
+
+COLUMNAR_SUFFIX = '.cols'
+HEADER_FILE = 'header.json'
+DELETED_FILE = 'deleted'
+INT_NULL = -2 ** 63
+DICT_MAX_ENTRIES = 256
+# Rows decoded per column read while scanning
+COLUMN_CHUNK_ROWS = 65536
+TYPECODES = {'int': 'q', 'float': 'd', 'dict': 'i'}
+WIDENING = {None: ('int', 'float', 'dict', 'str'), 'int': ('int', 'dict', 'str'),
+            'float': ('float', 'dict', 'str'), 'dict': ('dict', 'str'), 'str': ('str',)}
+
+# header.json path -> (mtime_ns, header)
+META_CACHE = {}
+
+
+def columnar_dir(filename):
+    return f"{filename[:-4]}{COLUMNAR_SUFFIX}"
+
+
+def is_columnar(filename):
+    return os.path.isdir(columnar_dir(filename))
+
+
+def column_path(filename, position, extension='col'):
+    return os.path.join(columnar_dir(filename), f"{position}.{extension}")
+
+
+def load_meta(filename):
+    path = os.path.join(columnar_dir(filename), HEADER_FILE)
+    mtime = os.stat(path).st_mtime_ns
+    cached = META_CACHE.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'r') as file:
+        meta = json.load(file)
+    META_CACHE[path] = (mtime, meta)
+    return meta
+
+
+def save_meta(filename, meta):
+    path = os.path.join(columnar_dir(filename), HEADER_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(meta, file)
+    os.replace(path + '.tmp', path)
+    META_CACHE[path] = (os.stat(path).st_mtime_ns, meta)
+
+
+def create_columnar(filename, columns, schema=None):
+    os.makedirs(columnar_dir(filename))
+    for position in range(len(columns)):
+        write_column(filename, position, None, [], [])
+    save_meta(filename, {"columns": list(columns), "rows": 0, "schema": dict(schema or {}),
+                         "types": [None] * len(columns), "dictionaries": [[] for _ in columns]})
+
+
+def columnar_header(filename):
+    return list(load_meta(filename)["columns"])
+
+
+def columnar_schema(filename):
+    return load_meta(filename).get("schema", {})
+
+
+def columnar_row_count(filename):
+    return load_meta(filename)["rows"] - len(columnar_dead_rows(filename))
+
+
+def columnar_dead_rows(filename):
+    # Numbers of the deleted rows, sorted
+    return read_tombstones(os.path.join(columnar_dir(filename), DELETED_FILE))
+
+
+def columnar_base(filename):
+    # Row count and tombstone file size, for columnar_restore to undo later inserts and deletes
+    deleted = os.path.join(columnar_dir(filename), DELETED_FILE)
+    return {"rows": load_meta(filename)["rows"], "tombstones": os.path.getsize(deleted) if os.path.exists(deleted) else 0}
+
+
+def columnar_restore(filename, base):
+    meta = load_meta(filename)
+    if meta["rows"] > base["rows"]:
+        meta["rows"] = base["rows"]
+        save_meta(filename, meta)
+    truncate_tombstones(os.path.join(columnar_dir(filename), DELETED_FILE), base["tombstones"])
+
+
+def columnar_bytes(filename):
+    directory = columnar_dir(filename)
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def fits_int(value):
+    if not value:
+        return True
+    try:
+        number = int(value)
+    except ValueError:
+        return False
+    return str(number) == value and INT_NULL < number < 2 ** 63
+
+
+def fits_float(value):
+    if not value:
+        return True
+    try:
+        number = float(value)
+    except ValueError:
+        return False
+    return math.isfinite(number) and repr(number) == value
+
+
+def choose_type(current, values, dictionary):
+    # Narrowest encoding at least as wide as current that stores every value exactly
+    distinct = set(values)
+    for kind in WIDENING[current]:
+        if kind == 'int' and all(map(fits_int, distinct)):
+            return kind
+        if kind == 'float' and all(map(fits_float, distinct)):
+            return kind
+        if kind == 'dict' and len(distinct.union(dictionary)) <= DICT_MAX_ENTRIES:
+            return kind
+        if kind == 'str':
+            return kind
+
+
+def encode(kind, values, dictionary):
+    # Array (or list of bytes for str) for values; new dictionary entries are added
+    if kind == 'int':
+        return array.array('q', [int(value) if value else INT_NULL for value in values])
+    if kind == 'float':
+        return array.array('d', [float(value) if value else math.nan for value in values])
+    if kind == 'dict':
+        codes = {value: code for code, value in enumerate(dictionary)}
+        for value in values:
+            if value not in codes:
+                codes[value] = len(dictionary)
+                dictionary.append(value)
+        return array.array('i', map(codes.__getitem__, values))
+    return [value.encode('utf-8') for value in values]
+
+
+def decode(kind, data, dictionary):
+    if kind == 'int':
+        if INT_NULL in data:
+            return ['' if value == INT_NULL else str(value) for value in data]
+        return list(map(str, data))
+    if kind == 'float':
+        return ['' if value != value else repr(value) for value in data]
+    return list(map(dictionary.__getitem__, data))
+
+
+def write_column(filename, position, kind, values, dictionary):
+    # Replaces the column file(s) with values encoded as kind
+    path = column_path(filename, position)
+    if kind == 'str' or kind is None:
+        encoded = encode('str', values, dictionary)
+        ends = array.array('Q', [0])
+        ends.extend(itertools.accumulate(map(len, encoded)))
+        with open(path + '.tmp', 'wb') as file:
+            file.write(b''.join(encoded))
+        with open(column_path(filename, position, 'off') + '.tmp', 'wb') as file:
+            ends.tofile(file)
+        os.replace(column_path(filename, position, 'off') + '.tmp', column_path(filename, position, 'off'))
+    else:
+        with open(path + '.tmp', 'wb') as file:
+            encode(kind, values, dictionary).tofile(file)
+        delete_if_exists(column_path(filename, position, 'off'))
+    os.replace(path + '.tmp', path)
+
+
+def append_column(filename, position, kind, rows, values, dictionary):
+    # Appends values after the first rows entries of the column
+    path = column_path(filename, position)
+    if kind == 'str' or kind is None:
+        offsets_path = column_path(filename, position, 'off')
+        with open(offsets_path, 'r+b') as file:
+            file.seek(rows * 8)
+            end = array.array('Q')
+            end.fromfile(file, 1)
+            encoded = encode('str', values, dictionary)
+            ends = array.array('Q', itertools.accumulate(map(len, encoded), initial=end[0]))[1:]
+            file.truncate((rows + 1) * 8)
+            file.seek(0, os.SEEK_END)
+            ends.tofile(file)
+        with open(path, 'r+b') as file:
+            file.truncate(end[0])
+            file.seek(0, os.SEEK_END)
+            file.write(b''.join(encoded))
+        return
+    data = encode(kind, values, dictionary)
+    with open(path, 'r+b') as file:
+        file.truncate(rows * data.itemsize)
+        file.seek(0, os.SEEK_END)
+        data.tofile(file)
+
+
+def read_column(filename, meta, position, start=0, stop=None):
+    # Text of column position for rows [start, stop)
+    kind = meta["types"][position]
+    stop = meta["rows"] if stop is None else stop
+    count = max(0, stop - start)
+    if count == 0:
+        return []
+    if kind == 'str' or kind is None:
+        ends = array.array('Q')
+        with open(column_path(filename, position, 'off'), 'rb') as file:
+            file.seek(start * 8)
+            ends.fromfile(file, count + 1)
+        with open(column_path(filename, position), 'rb') as file:
+            file.seek(ends[0])
+            data = file.read(ends[-1] - ends[0])
+        add_bytes_read(len(data) + len(ends) * ends.itemsize)
+        base = ends[0]
+        return [data[a - base:b - base].decode('utf-8') for a, b in zip(ends, ends[1:])]
+    data = array.array(TYPECODES[kind])
+    with open(column_path(filename, position), 'rb') as file:
+        file.seek(start * data.itemsize)
+        data.fromfile(file, count)
+    add_bytes_read(count * data.itemsize)
+    return decode(kind, data, meta["dictionaries"][position])
+
+
+def columnar_rows(filename, columns=None, numbered=False):
+    # Rows (lists in header order) of a columnar table, or (row number, row) pairs
+    # when numbered, skipping deleted rows. Only the named columns are read from
+    # disk; the cells of the other columns are ''.
+    meta = load_meta(filename)
+    dead = columnar_dead_rows(filename)
+    width = len(meta["columns"])
+    wanted = range(width) if columns is None else {meta["columns"].index(c) for c in columns if c in meta["columns"]}
+    for start in range(0, meta["rows"], COLUMN_CHUNK_ROWS):
+        stop = min(meta["rows"], start + COLUMN_CHUNK_ROWS)
+        cells = [read_column(filename, meta, position, start, stop) if position in wanted
+                 else itertools.repeat('', stop - start) for position in range(width)]
+        rows = map(list, zip(*cells))
+        removed = set(dead[bisect.bisect_left(dead, start):bisect.bisect_left(dead, stop)])
+        if not numbered and not removed:
+            yield from rows
+            continue
+        pairs = ((number, row) for number, row in zip(range(start, stop), rows) if number not in removed)
+        yield from pairs if numbered else (row for _, row in pairs)
+
+
+def columnar_append(filename, rows, batch_rows=None):
+    # Appends rows (lists in header order) batch by batch; returns the row count. If
+    # reading the rows fails part way, the table goes back to its previous row count.
+    meta = load_meta(filename)
+    width = len(meta["columns"])
+    start_rows, count = meta["rows"], 0
+    batch_rows = batch_rows or COLUMN_CHUNK_ROWS
+    rows = iter(rows)
+    try:
+        while True:
+            batch = list(itertools.islice(rows, batch_rows))
+            if not batch:
+                break
+            batch = [row[:width] + [''] * (width - len(row)) if len(row) != width else row for row in batch]
+            for position, values in enumerate(zip(*batch)):
+                kind, dictionary = meta["types"][position], meta["dictionaries"][position]
+                widened = choose_type(kind, values, dictionary)
+                if widened != kind:
+                    existing = read_column(filename, meta, position)
+                    dictionary = meta["dictionaries"][position] = dictionary if widened == 'dict' and kind == 'dict' else []
+                    write_column(filename, position, widened, existing, dictionary)
+                    meta["types"][position] = kind = widened
+                append_column(filename, position, kind, meta["rows"], values, dictionary)
+            meta["rows"] += len(batch)
+            count += len(batch)
+            save_meta(filename, meta)
+    except Exception:
+        meta["rows"] = start_rows
+        save_meta(filename, meta)
+        raise
+    return count
+
+
+def columnar_delete(filename, deleted):
+    # Marks the rows numbered in deleted as deleted; returns how many were not already
+    deleted = set(deleted).difference(columnar_dead_rows(filename))
+    add_tombstones(os.path.join(columnar_dir(filename), DELETED_FILE), sorted(deleted))
+    return len(deleted)
+
+
+def columnar_compact(filename):
+    # Rewrites every column without the deleted rows; returns how many were removed
+    meta = load_meta(filename)
+    deleted = set(columnar_dead_rows(filename))
+    if not deleted:
+        return 0
+    keep = [i not in deleted for i in range(meta["rows"])]
+    for position in range(len(meta["columns"])):
+        kind, dictionary = meta["types"][position], meta["dictionaries"][position]
+        values = list(itertools.compress(read_column(filename, meta, position), keep))
+        if kind == 'dict':
+            dictionary = meta["dictionaries"][position] = []
+        write_column(filename, position, kind, values, dictionary)
+    meta["rows"] -= len(deleted)
+    save_meta(filename, meta)
+    clear_tombstones(os.path.join(columnar_dir(filename), DELETED_FILE))
+    return len(deleted)
+
+
+def delete_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
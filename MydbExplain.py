@@ -0,0 +1,346 @@
+import io
+import os
+import sys
+import contextlib
+from time import perf_counter
+
+# EXPLAIN: "explain <select command>" prints the plan the command would run as a
+# tree of operators (scans, filters, joins, sorts, aggregates), each with the
+# choices made for it, without reading any rows. "explain analyze <select command>"
+# runs the command, discarding its output, and adds the counters of each operator:
+#   rows       rows taken from its inputs and rows it produced
+#   time       wall time in the operator and its inputs; self is the operator alone
+#   rows/s     rows produced per second of time
+#   read       bytes read from table, column and temp files
+#   spilled    bytes written to temp files (join partitions, sort runs)
+#   memory     most bytes of rows the operator held at once (hash tables, sort runs,
+#              groups, read buffers), estimated from the objects holding them
+# The code running a command declares each operator with plan_operator(); while no
+# command is explained that returns the rows unchanged and costs nothing.
+#
+# Functions registered with add_explain_hook get the counters as a list of dicts,
+# one per operator. While a hook is registered every select is counted this way,
+# except for memory, and passed to the hooks, as is every explain analyze.
+
+# The session of the command being explained or counted, None otherwise
+SESSION = None
+HOOKS = []
+
+
+class Operator:
+    """
+    One node of a plan: name and detail describe it, inputs are the operators it
+    reads from. An operator that produces its rows one by one wraps their iterable,
+    and iterating it counts them and charges the time taken by each to it. One that
+    works in a single pass instead runs inside `with operator:`; the operators made
+    while it runs that no other operator reads from become its inputs.
+    """
+
+    def __init__(self, session, name, detail, rows=None, inputs=()):
+        self.session = session
+        self.name = name
+        self.detail = detail
+        self.rows = iter(rows) if rows is not None else None
+        self.inputs = [op for op in inputs if isinstance(op, Operator)]
+        self.parent = session.stack[-1] if session.stack else None
+        self.rows_in = None
+        self.rows_out = 0
+        self.seconds = 0.0
+        self.bytes_read = 0
+        self.bytes_spilled = 0
+        self.peak_memory = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Same as session.enter and session.leave, inlined as this runs for every row
+        session, stack = self.session, self.session.stack
+        now = perf_counter()
+        if stack:
+            stack[-1].seconds += now - session.mark
+        stack.append(self)
+        session.mark = now
+        try:
+            row = next(self.rows)
+        finally:
+            now = perf_counter()
+            self.seconds += now - session.mark
+            session.mark = now
+            stack.pop()
+        self.rows_out += 1
+        return row
+
+    def close(self):
+        if hasattr(self.rows, 'close'):
+            self.rows.close()
+
+    def __enter__(self):
+        self.session.enter(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.session.leave()
+
+    def total_rows_in(self):
+        if self.rows_in is not None or not self.inputs:
+            return self.rows_in
+        return sum(op.rows_out for op in self.inputs)
+
+    def total_seconds(self):
+        return self.seconds + sum(op.total_seconds() for op in self.inputs)
+
+
+class BatchOperator(Operator):
+    """Operator whose iterable produces batches (lists) of rows; it counts the rows in them."""
+
+    def __next__(self):
+        batch = Operator.__next__(self)
+        self.rows_out += len(batch) - 1
+        return batch
+
+
+class ExplainSession:
+    """
+    The operators of one explained command. stack holds the operators running now,
+    innermost last; time is charged to the innermost one each time it changes.
+    hidden > 0 while a join runs its partitions, whose operators are not shown but
+    charged to the join. memory is False when operators need not estimate it.
+    """
+
+    def __init__(self, analyze=False, memory=False):
+        self.analyze = analyze
+        self.memory = memory
+        self.operators = []
+        self.stack = []
+        self.hidden = 0
+        self.mark = perf_counter()
+
+    def charge(self):
+        now = perf_counter()
+        if self.stack:
+            self.stack[-1].seconds += now - self.mark
+        self.mark = now
+
+    def enter(self, op):
+        self.charge()
+        self.stack.append(op)
+
+    def leave(self):
+        self.charge()
+        self.stack.pop()
+
+    def roots(self):
+        # Links operators to the one they ran inside when nothing else reads them;
+        # returns the operators at the top of the plan
+        claimed = {id(child) for op in self.operators for child in op.inputs}
+        roots = []
+        for op in self.operators:
+            if id(op) in claimed:
+                continue
+            if op.parent is not None:
+                op.parent.inputs.append(op)
+                claimed.add(id(op))
+            else:
+                roots.append(op)
+        return roots
+
+
+def plan_operator(name, detail='', rows=None, inputs=(), batched=False):
+    #Eg: rows = plan_operator("SeqScan", filename, scan_csv(filename))
+    #Eg: with running(plan_operator("HashJoin", "student.id = employees.id")): ...
+    # detail may be a function, called only when the command is explained; batched
+    # says rows produces lists of rows rather than rows
+    if SESSION is None or SESSION.hidden:
+        return rows
+    op = (BatchOperator if batched else Operator)(SESSION, name, detail() if callable(detail) else detail, rows, inputs)
+    SESSION.operators.append(op)
+    return op
+
+
+def running(op):
+    return op if op is not None else contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def hidden_operators():
+    if SESSION is None:
+        yield
+        return
+    SESSION.hidden += 1
+    try:
+        yield
+    finally:
+        SESSION.hidden -= 1
+
+
+def explaining():
+    # True while a command runs for explain or the hooks, which must see it read its rows
+    return SESSION is not None
+
+
+def plan_only():
+    # True while explain without analyze plans a command, which must then stop before reading rows
+    return SESSION is not None and not SESSION.analyze
+
+
+def count_rows(op, rows_out, rows_in=None):
+    if op is not None:
+        op.rows_out = rows_out
+        if rows_in is not None:
+            op.rows_in = rows_in
+
+
+def add_bytes_read(size):
+    if SESSION is not None and SESSION.stack:
+        SESSION.stack[-1].bytes_read += size
+
+
+def add_spilled(size):
+    if SESSION is not None and SESSION.stack:
+        SESSION.stack[-1].bytes_spilled += size
+
+
+def measuring_memory():
+    # True when operators should estimate the memory they hold and report it with add_memory
+    return SESSION is not None and SESSION.memory and bool(SESSION.stack)
+
+
+def add_memory(size):
+    # The running operator holds size bytes at once
+    if measuring_memory():
+        top = SESSION.stack[-1]
+        top.peak_memory = max(top.peak_memory, size)
+
+
+def held_bytes(value):
+    # Rough size in memory of value and everything in it
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        return size + sum(held_bytes(key) + held_bytes(item) for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(held_bytes(item) for item in value)
+    return size
+
+
+class CountedFile(io.FileIO):
+    """Binary file whose reads are charged to the running operator as bytes read."""
+
+    def readinto(self, buffer):
+        size = super().readinto(buffer)
+        add_bytes_read(size or 0)
+        return size
+
+
+def open_counted(filename):
+    # filename opened for reading as text (like open(filename, 'r', newline='')), with
+    # the bytes actually read charged to the running operator
+    return io.TextIOWrapper(io.BufferedReader(CountedFile(filename)), newline='')
+
+
+def add_explain_hook(hook):
+    #Eg: add_explain_hook(lambda command, operators: metrics.send(operators))
+    # hook(command, operators) gets one dict per operator, in plan order
+    HOOKS.append(hook)
+
+
+def remove_explain_hook(hook):
+    HOOKS.remove(hook)
+
+
+def observing():
+    # True when a select should be counted for the hooks
+    return bool(HOOKS) and SESSION is None
+
+
+def explain_command(command, run):
+    #Eg: explain select id,name from employees where salary>50000
+    #Eg: explain analyze select department,COUNT() from employees group_by department
+    #Eg: explain analyze execute by_id 42
+    # run is the process_command of the script the command came to
+    global SESSION
+    words = command.split(maxsplit=2)
+    analyze = len(words) > 1 and words[1].lower() == 'analyze'
+    statement = ' '.join(words[2:] if analyze else words[1:])
+    if statement.split(maxsplit=1)[:1] not in (['select'], ['execute']):
+        return "Only select and execute commands can be explained"
+
+    session = ExplainSession(analyze, memory=analyze)
+    SESSION = session
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = run(statement)
+    finally:
+        SESSION = None
+    if not session.operators:
+        return result
+    operators = plan_operators(session)
+    if analyze:
+        notify_hooks(statement, operators)
+    lines = [format_operator(op, analyze) for op in operators]
+    if analyze:
+        lines.append(result)
+    return '\n'.join(lines)
+
+
+def observe_command(command, run):
+    # Runs the command as usual, then passes its counters to the hooks
+    global SESSION
+    session = ExplainSession(True)
+    SESSION = session
+    try:
+        return run(command)
+    finally:
+        SESSION = None
+        notify_hooks(command, plan_operators(session))
+
+
+def notify_hooks(command, operators):
+    for hook in list(HOOKS):
+        hook(command, operators)
+
+
+def plan_operators(session):
+    # The operators of the plan as dicts, depth first with each operator before its inputs
+    operators = []
+
+    def visit(op, depth):
+        seconds = op.total_seconds()
+        operators.append({
+            "operator": op.name, "detail": op.detail, "depth": depth,
+            "rows_in": op.total_rows_in(), "rows_out": op.rows_out,
+            "seconds": seconds, "self_seconds": op.seconds,
+            "rows_per_second": op.rows_out / seconds if seconds > 0 else None,
+            "bytes_read": op.bytes_read, "bytes_spilled": op.bytes_spilled,
+            "peak_memory": op.peak_memory if session.memory else None,
+        })
+        for child in op.inputs:
+            visit(child, depth + 1)
+
+    for root in session.roots():
+        visit(root, 0)
+    return operators
+
+
+def format_operator(op, analyze):
+    line = '  ' * op["depth"] + ('-> ' if op["depth"] else '') + op["operator"]
+    if op["detail"]:
+        line += f" ({op['detail']})"
+    if not analyze:
+        return line
+    rows_in = '-' if op["rows_in"] is None else op["rows_in"]
+    rate = '-' if op["rows_per_second"] is None else f"{op['rows_per_second']:,.0f}"
+    line += (f"  rows in={rows_in} out={op['rows_out']}"
+             f"  time={op['seconds'] * 1000:.2f} ms (self {op['self_seconds'] * 1000:.2f} ms)"
+             f"  rows/s={rate}  read={format_bytes(op['bytes_read'])}"
+             f"  spilled={format_bytes(op['bytes_spilled'])}")
+    if op["peak_memory"] is not None:
+        line += f"  memory={format_bytes(op['peak_memory'])}"
+    return line
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
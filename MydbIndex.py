@@ -0,0 +1,256 @@
+import os
+import csv
+import glob
+import bisect
+
+from MydbExplain import add_bytes_read
+
+# Secondary indexes: <table>.<column>.idx holds a header row [column, key type]
+# followed by key,offset rows sorted by key, where offset is the byte offset of
+# the record in the table file. Inserts append unsorted entries to the end of
+# the file; they are merged back into order when the index is loaded.
+
+INDEX_OPERATORS = ('==', '>', '<', '>=', '<=')
+
+# index file -> (stat key, column, key type, keys, offsets), keys sorted
+INDEX_CACHE = {}
+# table file -> (stat key, header)
+HEADER_CACHE = {}
+
+
+def index_filename(filename, column):
+    return f"{filename[:-4]}.{column}.idx"
+
+
+def table_indexes(filename):
+    # Columns of filename that have an index
+    prefix = filename[:-4] + '.'
+    return [path[len(prefix):-4] for path in sorted(glob.glob(glob.escape(prefix) + '*.idx'))]
+
+
+def scan_records(file, offset=0):
+    # Yields (offset, raw record) from a table opened in binary mode. A record ends at
+    # a newline outside quotes, so quoted newlines stay inside one record.
+    file.seek(offset)
+    start, pending, quotes = offset, [], 0
+    for line in file:
+        pending.append(line)
+        offset += len(line)
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            yield start, b''.join(pending)
+            start, pending, quotes = offset, [], 0
+    if pending:
+        yield start, b''.join(pending)
+
+
+def decode_record(raw):
+    return next(csv.reader([raw.decode('utf-8')]))
+
+
+def read_record_at(file, offset):
+    # Returns (row, record length) for the record starting at offset
+    for _, raw in scan_records(file, offset):
+        return decode_record(raw), len(raw)
+    return None, 0
+
+
+def read_rows_at(filename, offsets):
+    # Reads only the records at the given byte offsets, in file order
+    with open(filename, 'rb') as file:
+        for offset in sorted(offsets):
+            row, length = read_record_at(file, offset)
+            add_bytes_read(length)
+            if row is not None:
+                yield row
+
+
+def read_header(filename):
+    stat = os.stat(filename)
+    key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    cached = HEADER_CACHE.get(filename)
+    if cached and cached[0] == key:
+        return list(cached[1])
+    with open(filename, 'r', newline='') as file:
+        header = next(csv.reader(file))
+    HEADER_CACHE[filename] = (key, header)
+    return list(header)
+
+
+def numeric_key(value):
+    # Empty cells compare as 0, the same as in compiled where clauses
+    if not value:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def is_numeric(value):
+    try:
+        numeric_key(value)
+        return True
+    except ValueError:
+        return False
+
+
+def make_key(value, key_type):
+    return numeric_key(value) if key_type == 'num' else (value or '0')
+
+
+def build_index(filename, column):
+    header = read_header(filename)
+    if column not in header:
+        raise ValueError(f"Unknown column: {column}")
+    position = header.index(column)
+
+    entries = []
+    with open(filename, 'rb') as file:
+        records = scan_records(file)
+        next(records, None)  # header
+        for offset, raw in records:
+            row = decode_record(raw)
+            entries.append((row[position] if position < len(row) else '', offset))
+
+    key_type = 'num' if all(is_numeric(value) for value, _ in entries) else 'str'
+    entries = sorted((make_key(value, key_type), offset) for value, offset in entries)
+    write_index(filename, column, key_type, entries)
+    return len(entries)
+
+
+def write_index(filename, column, key_type, entries):
+    path = index_filename(filename, column)
+    with open(path + '.tmp', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([column, key_type])
+        writer.writerows(entries)
+    os.replace(path + '.tmp', path)
+    cache_index(path, column, key_type, [key for key, _ in entries], [offset for _, offset in entries])
+
+
+def cache_index(path, column, key_type, keys, offsets):
+    stat = os.stat(path)
+    INDEX_CACHE[path] = ((stat.st_mtime_ns, stat.st_size), column, key_type, keys, offsets)
+
+
+def load_index(filename, column):
+    path = index_filename(filename, column)
+    stat = os.stat(path)
+    cached = INDEX_CACHE.get(path)
+    if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached
+
+    with open(path, 'r', newline='') as file:
+        reader = csv.reader(file)
+        _, key_type = next(reader)
+        convert = numeric_key if key_type == 'num' else str
+        entries = sorted((convert(key), int(offset)) for key, offset in reader)
+    cache_index(path, column, key_type, [key for key, _ in entries], [offset for _, offset in entries])
+    return INDEX_CACHE[path]
+
+
+def index_lookup(filename, column, operator, value):
+    # Offsets of the records that can satisfy column <operator> value, or None when
+    # the index cannot answer the comparison and the table must be scanned.
+    span = index_span(filename, column, operator, value)
+    if span is None:
+        return None
+    offsets = load_index(filename, column)[4]
+    return sorted(offsets[span[0]:span[1]])
+
+
+def index_span(filename, column, operator, value):
+    # (lo, hi) such that entries lo..hi-1 of the index are the ones that can satisfy
+    # column <operator> value, or None when the index cannot answer the comparison
+    if operator not in INDEX_OPERATORS:
+        return None
+    _, _, key_type, keys, _ = load_index(filename, column)
+    if key_type == 'num':
+        try:
+            key = numeric_key(value)
+        except ValueError:
+            return (0, 0) if operator == '==' else None
+    elif operator == '==':
+        key = value
+    else:
+        return None
+
+    if operator == '==':
+        lo, hi = bisect.bisect_left(keys, key), bisect.bisect_right(keys, key)
+    elif operator == '>':
+        lo, hi = bisect.bisect_right(keys, key), len(keys)
+    elif operator == '>=':
+        lo, hi = bisect.bisect_left(keys, key), len(keys)
+    elif operator == '<':
+        lo, hi = 0, bisect.bisect_left(keys, key)
+    else:
+        lo, hi = 0, bisect.bisect_right(keys, key)
+    return lo, hi
+
+
+def index_append(filename, header, start_offset):
+    # Adds the records appended to the table from start_offset onwards to every index
+    columns = table_indexes(filename)
+    if not columns:
+        return
+    with open(filename, 'rb') as file:
+        appended = [(decode_record(raw), offset) for offset, raw in scan_records(file, start_offset)]
+
+    for column in columns:
+        path = index_filename(filename, column)
+        _, _, key_type, keys, offsets = load_index(filename, column)
+        position = header.index(column)
+        values = [(row[position] if position < len(row) else '', offset) for row, offset in appended]
+        if key_type == 'num' and not all(is_numeric(value) for value, _ in values):
+            build_index(filename, column)
+            continue
+        entries = [(make_key(value, key_type), offset) for value, offset in values]
+        with open(path, 'a', newline='') as file:
+            csv.writer(file).writerows(entries)
+        if len(entries) < 64:
+            for key, offset in entries:
+                pos = bisect.bisect_right(keys, key)
+                keys.insert(pos, key)
+                offsets.insert(pos, offset)
+        else:
+            merged = sorted(list(zip(keys, offsets)) + entries)
+            keys, offsets = [key for key, _ in merged], [offset for _, offset in merged]
+        cache_index(path, column, key_type, keys, offsets)
+
+
+def remove_records(filename, spans):
+    # Deletes the (offset, length) records from the table by copying the bytes
+    # between them, then shifts the offsets held by every index of the table.
+    spans = sorted(spans)
+    if not spans:
+        return
+    with open(filename, 'rb') as src, open(filename + '.tmp', 'wb') as dst:
+        position = 0
+        for offset, length in spans:
+            src.seek(position)
+            dst.write(src.read(offset - position))
+            position = offset + length
+        src.seek(position)
+        while True:
+            block = src.read(1 << 20)
+            if not block:
+                break
+            dst.write(block)
+    os.replace(filename + '.tmp', filename)
+
+    starts = [offset for offset, _ in spans]
+    removed = set(starts)
+    shifted = [0]
+    for _, length in spans:
+        shifted.append(shifted[-1] + length)
+    for column in table_indexes(filename):
+        _, _, key_type, keys, offsets = load_index(filename, column)
+        entries = [(key, offset - shifted[bisect.bisect_left(starts, offset)])
+                   for key, offset in zip(keys, offsets) if offset not in removed]
+        write_index(filename, column, key_type, entries)
+
+
+def rebuild_indexes(filename):
+    for column in table_indexes(filename):
+        build_index(filename, column)
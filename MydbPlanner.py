@@ -0,0 +1,304 @@
+import math
+import itertools
+
+from MydbIndex import INDEX_OPERATORS, table_indexes, index_span, numeric_key
+from MydbCatalog import table_stats, distinct_count
+from MydbZonemap import candidate_blocks, skips_blocks
+from MydbColumnar import is_columnar, columnar_header, columnar_row_count, columnar_bytes, columnar_schema
+from MydbSort import SORT_MAX_FANIN
+
+# Cost-based planner: picks how to read a table for a where clause (a full scan, a
+# scan of the zone map's candidate blocks or an index lookup) and how to run a join
+# (the order of its tables, and per join a hash, grace hash, merge, nested loop or
+# index nested loop join with its build side) from the row counts, sizes and column
+# statistics in the catalog.
+#
+# Costs are estimated microseconds on a warm page cache, per row or byte handled by
+# each kind of step; the constants were measured on this code and only their ratios
+# matter. Selectivities come from the column statistics: an equality matches
+# 1/distinct values of the non-empty cells, a range the fraction of [min, max] it
+# covers, and conditions whose column has no statistics fall back to the defaults.
+
+SCAN_ROW_COST = 0.4
+SCAN_BYTE_COST = 0.01
+INDEX_LOOKUP_COST = 6.0
+INDEX_ROW_COST = 3.5
+HASH_BUILD_COST = 1.5
+HASH_PROBE_COST = 0.25
+MERGE_ROW_COST = 0.5
+SORT_ROW_COST = 1.3
+COMPARE_COST = 0.05
+NESTED_ROW_COST = 0.6
+NESTED_PAIR_COST = 0.04
+SPILL_ROW_COST = 1.6
+SPILL_FILE_COST = 170.0
+OUTPUT_ROW_COST = 1.0
+
+DEFAULT_EQUAL_SELECTIVITY = 0.1
+DEFAULT_RANGE_SELECTIVITY = 1 / 3
+
+
+def table_profile(filename):
+    # Row count, byte size, columns, column statistics and column types of a table.
+    # Columnar tables keep no column statistics, so their conditions use the defaults.
+    if is_columnar(filename):
+        return {"rows": columnar_row_count(filename), "bytes": columnar_bytes(filename),
+                "columns": columnar_header(filename), "stats": {}, "schema": columnar_schema(filename)}
+    table = table_stats(filename)
+    return {"rows": table["rows"], "bytes": table["bytes"], "columns": table["columns"],
+            "stats": table["stats"], "schema": table.get("schema", {})}
+
+
+def column_distinct(filename, profile, column):
+    # Estimated distinct non-empty values of the column, at least 1
+    stats = profile["stats"].get(column)
+    if stats is None:
+        return max(1, profile["rows"])
+    return max(1, min(distinct_count(filename, column), profile["rows"] - stats["nulls"]))
+
+
+def selectivity(filename, profile, conditions):
+    # Estimated fraction of the table's rows matching a parsed where clause
+    if not conditions:
+        return 1.0
+    if conditions[0] == 'AND':
+        return selectivity(filename, profile, conditions[1]) * selectivity(filename, profile, conditions[2])
+    if conditions[0] == 'OR':
+        left, right = selectivity(filename, profile, conditions[1]), selectivity(filename, profile, conditions[2])
+        return left + right - left * right
+
+    _, field, operator, value = conditions
+    stats = profile["stats"].get(field)
+    rows = profile["rows"]
+    if stats is None or not rows:
+        if operator == '==':
+            return DEFAULT_EQUAL_SELECTIVITY
+        return 1 - DEFAULT_EQUAL_SELECTIVITY if operator == '!=' else DEFAULT_RANGE_SELECTIVITY
+    present = (rows - stats["nulls"]) / rows
+    number = numeric_value(value)
+    numeric = stats["non_numeric"] == 0 and stats["num_min"] is not None and number is not None
+
+    if operator in ('==', '!='):
+        if numeric:
+            in_range = stats["num_min"] <= number <= stats["num_max"]
+        else:
+            in_range = stats["str_min"] is not None and stats["str_min"] <= value <= stats["str_max"]
+        equal = present / column_distinct(filename, profile, field) if in_range else 0.0
+        return equal if operator == '==' else 1 - equal
+    if not numeric:
+        return DEFAULT_RANGE_SELECTIVITY
+    low, high = stats["num_min"], stats["num_max"]
+    if high == low:
+        below = 1.0 if number > low else 0.0
+        above = 1.0 if number < low else 0.0
+        equal = 1.0 - below - above
+    else:
+        below = min(1.0, max(0.0, (number - low) / (high - low)))
+        above = 1.0 - below
+        equal = 1 / column_distinct(filename, profile, field)
+    fraction = {'<': below, '<=': below + equal, '>': above, '>=': above + equal}[operator]
+    return present * min(1.0, max(0.0, fraction))
+
+
+def numeric_value(value):
+    try:
+        return numeric_key(value) if value else None
+    except ValueError:
+        return None
+
+
+def plan_access(filename, conditions, profile=None):
+    #Eg: plan_access('employees.csv', parse_conditions('id==5')[0])
+    #    -> {"path": "index", "index": ('id', '==', '5'), "rows": 1.0, "cost": 9.5}
+    # The cheapest way to read the rows of filename that can match the pruning
+    # conditions: "seq" (every row), "zonemap" (the candidate blocks), "index" (the
+    # records an index finds for one comparison of the clause, index gives which) or
+    # "columnar". rows is the estimated number of rows matching the conditions.
+    if profile is None:
+        profile = table_profile(filename)
+    rows = profile["rows"] * selectivity(filename, profile, conditions)
+    if is_columnar(filename):
+        return {"path": "columnar", "index": None, "rows": rows, "cost": profile["rows"] * SCAN_ROW_COST}
+    best = {"path": "seq", "index": None, "rows": rows,
+            "cost": profile["rows"] * SCAN_ROW_COST + profile["bytes"] * SCAN_BYTE_COST}
+    if not conditions:
+        return best
+
+    if skips_blocks(filename, conditions):
+        blocks = candidate_blocks(filename, conditions)
+        block_rows = sum(block["rows"] for block in blocks)
+        cost = block_rows * SCAN_ROW_COST + sum(block["end"] - block["start"] for block in blocks) * SCAN_BYTE_COST
+        if cost < best["cost"]:
+            best = {"path": "zonemap", "index": None, "rows": min(rows, block_rows), "cost": cost}
+
+    indexed_columns = table_indexes(filename)
+    for comparison in index_comparisons(conditions, indexed_columns):
+        span = index_span(filename, *comparison)
+        if span is None:
+            continue
+        found = span[1] - span[0]
+        cost = INDEX_LOOKUP_COST + found * INDEX_ROW_COST
+        if cost < best["cost"]:
+            best = {"path": "index", "index": comparison, "rows": min(rows, found), "cost": cost}
+    return best
+
+
+def index_comparisons(conditions, indexed_columns):
+    # (column, operator, value) of the comparisons every matching row must satisfy
+    # (the whole clause or one side of an AND) that an index could answer
+    if not conditions or not indexed_columns:
+        return []
+    if conditions[0] == 'AND':
+        return index_comparisons(conditions[1], indexed_columns) + index_comparisons(conditions[2], indexed_columns)
+    if conditions[0] == 'CMP' and conditions[1] in indexed_columns and conditions[2] in INDEX_OPERATORS:
+        return [tuple(conditions[1:])]
+    return []
+
+
+def plan_joins(tables, edges, memory_budget):
+    #Eg: plan_joins({'student': ('student.csv', None), 'employees': ('employees.csv', None)},
+    #               [('student', 'id', 'employees', 'id')], 64 * 1024 * 1024)
+    # tables maps each table name to (filename, pruning conditions on it alone), in
+    # query order; edges are the equi-join conditions (table1, column1, table2, column2).
+    # Returns the cheapest left-deep plan, found by dynamic programming over the sets
+    # of tables joined so far. A leaf of the plan is
+    #   {"table", "filename", "access", "rows", "width", "columns", "cost", "tables", "sorted_on"}
+    # and a join is
+    #   {"method", "left", "right", "left_key", "right_key", "extra_keys", "build_left", "sort_left",
+    #    "sort_right", "rows", "width", "columns", "cost", "tables", "sorted_on"}
+    # where right is always a leaf, left_key and right_key are the (table, column) the
+    # join matches on and extra_keys are further equalities checked on the joined rows.
+    # rows are estimated output rows, width and columns the bytes and cells of a row,
+    # cost the estimated cost of the whole subtree and sorted_on the table.column
+    # names its rows come out sorted by.
+    leaves = {name: plan_leaf(name, filename, conditions) for name, (filename, conditions) in tables.items()}
+    names = list(tables)
+    best = {frozenset([name]): leaf for name, leaf in leaves.items()}
+    for size in range(2, len(names) + 1):
+        for subset in itertools.combinations(names, size):
+            joined = frozenset(subset)
+            # The last table in query order is tried as the inner side first, so
+            # ties keep the query order
+            for name in reversed(subset):
+                left = best.get(joined - {name})
+                if left is None:
+                    continue
+                keys = join_keys(edges, set(left["tables"]), name)
+                if not keys:
+                    continue
+                plan = plan_join(left, leaves[name], keys, leaves, memory_budget)
+                if joined not in best or plan["cost"] < best[joined]["cost"]:
+                    best[joined] = plan
+    plan = best.get(frozenset(names))
+    if plan is None:
+        raise ValueError("Every table of a join must be joined to the others by an on condition")
+    return plan
+
+
+def plan_leaf(table, filename, conditions):
+    profile = table_profile(filename)
+    access = plan_access(filename, conditions, profile)
+    schema = profile["schema"]
+    # File order is sorted on a column whose numbers never decrease, as long as its
+    # empty cells are skipped (typed) or there are none
+    sorted_on = {f"{table}.{column}" for column, stats in profile["stats"].items()
+                 if stats.get("ascending", False) and (stats["nulls"] == 0 or column in schema)}
+    return {"table": table, "filename": filename, "profile": profile, "access": access,
+            "rows": access["rows"], "width": profile["bytes"] / profile["rows"] if profile["rows"] else 0,
+            "columns": len(profile["columns"]), "cost": access["cost"], "tables": [table], "sorted_on": sorted_on}
+
+
+def join_keys(edges, joined, table):
+    # The edges between the joined tables and table, as (joined table, column, table, column)
+    keys = []
+    for table1, column1, table2, column2 in edges:
+        if table1 in joined and table2 == table:
+            keys.append((table1, column1, table2, column2))
+        elif table2 in joined and table1 == table:
+            keys.append((table2, column2, table1, column1))
+    return keys
+
+
+def key_distinct(leaves, table, column, rows):
+    leaf = leaves[table]
+    return max(1, min(column_distinct(leaf["filename"], leaf["profile"], column), rows))
+
+
+def plan_join(left, right, keys, leaves, memory_budget):
+    rows = left["rows"] * right["rows"]
+    for left_table, left_column, right_table, right_column in keys:
+        rows /= max(key_distinct(leaves, left_table, left_column, left["rows"]),
+                    key_distinct(leaves, right_table, right_column, right["rows"]))
+    left_table, left_column, right_table, right_column = keys[0]
+    left_name, right_name = f"{left_table}.{left_column}", f"{right_table}.{right_column}"
+
+    # An intermediate result streams into the join above it
+    inputs = left["cost"]
+    left_bytes, right_bytes = left["rows"] * left["width"], right["rows"] * right["width"]
+    options = []
+
+    build_left = left_bytes <= right_bytes
+    build_rows, probe_rows = (left["rows"], right["rows"]) if build_left else (right["rows"], left["rows"])
+    cost = right["cost"] + HASH_BUILD_COST * build_rows + HASH_PROBE_COST * probe_rows
+    build_bytes = min(left_bytes, right_bytes)
+    if build_bytes <= memory_budget:
+        options.append((cost, {"method": "hash", "build_left": build_left,
+                               "sorted_on": (right if build_left else left)["sorted_on"]}))
+    else:
+        # Both sides are written to partition files, as many as grace_join_rows makes
+        partitions = min(128, max(2, math.ceil(2 * build_bytes / memory_budget)))
+        cost += SPILL_ROW_COST * (left["rows"] + right["rows"]) + SPILL_FILE_COST * 2 * partitions
+        options.append((cost, {"method": "grace", "build_left": None, "sorted_on": set()}))
+
+    if mergeable(leaves, left_table, left_column) and mergeable(leaves, right_table, right_column):
+        sort_left, sort_right = left_name not in left["sorted_on"], right_name not in right["sorted_on"]
+        cost = right["cost"] + MERGE_ROW_COST * (left["rows"] + right["rows"])
+        cost += (sort_cost(left, memory_budget) if sort_left else 0)
+        cost += (sort_cost(right, memory_budget) if sort_right else 0)
+        options.append((cost, {"method": "merge", "sort_left": sort_left, "sort_right": sort_right,
+                               "sorted_on": {left_name, right_name}}))
+
+    # The inner side is read again for each block of the outer side that fits in memory
+    blocks = max(1, math.ceil(left_bytes / memory_budget))
+    cost = right["cost"] * blocks + NESTED_ROW_COST * left["rows"] + NESTED_PAIR_COST * left["rows"] * right["rows"]
+    options.append((cost, {"method": "nested_loop", "sorted_on": set()}))
+
+    filename = right["filename"]
+    if not is_columnar(filename) and right_column in table_indexes(filename):
+        profile = right["profile"]
+        fetched = left["rows"] * profile["rows"] / key_distinct(leaves, right_table, right_column, profile["rows"])
+        options.append((INDEX_LOOKUP_COST * left["rows"] + INDEX_ROW_COST * fetched,
+                        {"method": "index_nested_loop", "sorted_on": left["sorted_on"]}))
+
+    cost, choice = min(options, key=lambda option: option[0])
+    plan = {"method": None, "left": left, "right": right, "left_key": (left_table, left_column),
+            "right_key": (right_table, right_column), "extra_keys": keys[1:], "build_left": None,
+            "sort_left": False, "sort_right": False, "rows": rows, "width": left["width"] + right["width"],
+            "columns": left["columns"] + right["columns"], "cost": inputs + cost + OUTPUT_ROW_COST * rows, "tables": left["tables"] + right["tables"]}
+    plan.update(choice)
+    return plan
+
+
+def mergeable(leaves, table, column):
+    # A merge join orders keys as numbers, so every non-empty key must be one
+    stats = leaves[table]["profile"]["stats"].get(column)
+    return stats is not None and stats["non_numeric"] == 0
+
+
+def sort_cost(plan, memory_budget):
+    # An external sort spills a run each time the rows it holds, as lists of str,
+    # reach memory_budget bytes; those take several times their bytes in the file
+    rows = plan["rows"]
+    cost = rows * (SORT_ROW_COST + math.log2(max(rows, 2)) * COMPARE_COST)
+    runs = math.ceil(rows * (plan["width"] + 56 + 57 * plan["columns"]) / memory_budget)
+    if runs <= 1:
+        return cost
+    passes = max(1, math.ceil(math.log(runs, SORT_MAX_FANIN)))
+    return cost + passes * (SPILL_ROW_COST * rows + SPILL_FILE_COST * runs)
+
+
+def plan_text(plan):
+    # The join order with each join's method, e.g. ((student hash employees) merge books)
+    if "method" not in plan:
+        return plan["table"]
+    return f"({plan_text(plan['left'])} {plan['method']} {plan['right']['table']})"
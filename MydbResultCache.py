@@ -0,0 +1,113 @@
+import os
+from collections import OrderedDict, defaultdict
+
+from MydbColumnar import is_columnar, columnar_dir
+from MydbSort import estimate_row_bytes
+from MydbTombstone import tombstone_filename
+
+# Result cache: the rows a select produced, kept under its parsed query with the
+# versions of the tables it read, so running it again on unchanged tables reads
+# nothing. A table's version is the number of writes MyDB made to it plus the size
+# and mtime of its files and its tombstone file, which also catches changes made
+# outside MyDB. The cache is off until enable_result_cache gives it a size.
+
+# Bytes of rows the cache may hold; 0 turns it off
+RESULT_CACHE_BYTES = 0
+
+# query -> (table versions, fieldnames, rows, bytes), least recently used first
+RESULT_CACHE = OrderedDict()
+RESULT_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+# table file -> writes counted by bump_table_version
+TABLE_VERSIONS = defaultdict(int)
+
+
+def enable_result_cache(max_bytes):
+    #Eg: enable_result_cache(64 * 1024 * 1024)
+    #Eg: enable_result_cache(0)  # off
+    global RESULT_CACHE_BYTES
+    RESULT_CACHE_BYTES = max_bytes
+    evict_results()
+
+
+def result_cache_enabled():
+    return RESULT_CACHE_BYTES > 0
+
+
+def result_cache_stats():
+    return dict(RESULT_CACHE_STATS, entries=len(RESULT_CACHE), max_bytes=RESULT_CACHE_BYTES)
+
+
+def clear_result_cache():
+    RESULT_CACHE.clear()
+    RESULT_CACHE_STATS.update(hits=0, misses=0, evictions=0, bytes=0)
+
+
+def bump_table_version(filename):
+    # Called by every command that changes the table's rows
+    TABLE_VERSIONS[filename] += 1
+
+
+def table_version(filename):
+    # The table's write count with (name, size, mtime) of each of its files and of its
+    # tombstone file, if it has one; None when the table has no files
+    if is_columnar(filename):
+        directory = columnar_dir(filename)
+        paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    else:
+        paths = [filename]
+    try:
+        stats = [os.stat(path) for path in paths]
+    except FileNotFoundError:
+        return None
+    tombstones = tombstone_filename(filename)
+    if os.path.exists(tombstones):
+        paths.append(tombstones)
+        stats.append(os.stat(tombstones))
+    return (TABLE_VERSIONS[filename],) + tuple((path, stat.st_size, stat.st_mtime_ns)
+                                               for path, stat in zip(paths, stats))
+
+
+def table_versions(filenames):
+    return tuple(table_version(filename) for filename in filenames)
+
+
+def cached_result(query, filenames):
+    # (fieldnames, rows) the query produced when its tables were as they are now, or None
+    cached = RESULT_CACHE.get(query)
+    if cached is not None and cached[0] == table_versions(filenames):
+        RESULT_CACHE.move_to_end(query)
+        RESULT_CACHE_STATS["hits"] += 1
+        return cached[1], cached[2]
+    if cached is not None:
+        # One of its tables changed
+        drop_result(query)
+    RESULT_CACHE_STATS["misses"] += 1
+    return None
+
+
+def caching_batches(query, filenames, fieldnames, batches):
+    # Passes the batches on and caches their rows once they are all through, unless
+    # they hold more than the whole cache
+    rows, size = [], 0
+    for batch in batches:
+        if rows is not None:
+            size += sum(estimate_row_bytes(row) for row in batch)
+            if size > RESULT_CACHE_BYTES:
+                rows = None
+            else:
+                rows.extend(batch)
+        yield batch
+    if rows is not None:
+        RESULT_CACHE[query] = (table_versions(filenames), fieldnames, rows, size)
+        RESULT_CACHE_STATS["bytes"] += size
+        evict_results()
+
+
+def drop_result(query):
+    RESULT_CACHE_STATS["bytes"] -= RESULT_CACHE.pop(query)[3]
+
+
+def evict_results():
+    while RESULT_CACHE and RESULT_CACHE_STATS["bytes"] > RESULT_CACHE_BYTES:
+        drop_result(next(iter(RESULT_CACHE)))
+        RESULT_CACHE_STATS["evictions"] += 1
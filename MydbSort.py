@@ -0,0 +1,80 @@
+import os
+import csv
+import heapq
+import tempfile
+
+from MydbExplain import add_spilled, add_memory, open_counted
+
+# External sort: sorts rows of any size in runs of at most SORT_MEMORY_BUDGET bytes,
+# spilling each sorted run to a temp file and merging the runs back; used by ORDER_BY
+# and merge joins.
+
+# Bytes of rows a sort may hold in memory before spilling a sorted run to disk
+SORT_MEMORY_BUDGET = 64 * 1024 * 1024
+# Most runs merged at once; beyond this an extra merge pass keeps file handles bounded
+SORT_MAX_FANIN = 256
+
+
+def estimate_row_bytes(row):
+    # Rough in-memory size of a row held as a list of str
+    return 56 + 8 * len(row) + sum(49 + len(value) for value in row)
+
+
+def external_sort(rows, sort_key, memory_budget=None):
+    """
+    Sorts rows that may not fit in memory. Rows are collected into runs of up to
+    memory_budget bytes; each full run is sorted and spilled to a private temp
+    directory, and the spilled runs plus the final in-memory run are combined
+    with a single k-way heap merge.
+    """
+    if memory_budget is None:
+        memory_budget = SORT_MEMORY_BUDGET
+    with tempfile.TemporaryDirectory(prefix="mydb_sort_") as spill_dir:
+        runs, run, run_bytes = [], [], 0
+        for row in rows:
+            run.append(row)
+            run_bytes += estimate_row_bytes(row)
+            if run_bytes >= memory_budget:
+                add_memory(run_bytes)
+                run.sort(key=sort_key)
+                runs.append(write_run(run, os.path.join(spill_dir, f"run_{len(runs)}.csv")))
+                run, run_bytes = [], 0
+        add_memory(run_bytes)
+        run.sort(key=sort_key)
+        if not runs:
+            yield from run
+            return
+
+        # Only inputs with more runs than SORT_MAX_FANIN need an extra merge pass
+        level = 0
+        while len(runs) > SORT_MAX_FANIN:
+            runs = [merge_runs(runs[i:i + SORT_MAX_FANIN], sort_key,
+                               os.path.join(spill_dir, f"merged_{level}_{i}.csv"))
+                    for i in range(0, len(runs), SORT_MAX_FANIN)]
+            level += 1
+
+        files = [open_counted(path) for path in runs]
+        try:
+            yield from heapq.merge(*[csv.reader(file) for file in files], run, key=sort_key)
+        finally:
+            for file in files:
+                file.close()
+
+
+def write_run(rows, path):
+    with open(path, 'w', newline='') as file:
+        csv.writer(file).writerows(rows)
+        add_spilled(file.tell())
+    return path
+
+
+def merge_runs(paths, sort_key, output_path):
+    files = [open_counted(path) for path in paths]
+    try:
+        write_run(heapq.merge(*[csv.reader(file) for file in files], key=sort_key), output_path)
+    finally:
+        for file in files:
+            file.close()
+    for path in paths:
+        os.remove(path)
+    return output_path
@@ -0,0 +1,127 @@
+import contextlib
+from collections import OrderedDict
+
+# Statement cache and prepared statements: a command's text, with runs of whitespace
+# collapsed, maps to its parsed statement, so a command sent again skips parsing. A
+# prepared statement names such a text in which ? stands for a value of the where
+# clause; execute binds the values, in order, to a copy of the parsed where clause.
+# The plans an execution chose (access paths, join order and methods) are kept with
+# the versions of its tables and reused by the next executions until a table changes.
+
+# Parsed statements kept; the least recently used one is dropped beyond this
+STATEMENT_CACHE_SIZE = 256
+PARAMETER = '?'
+
+# normalized command text -> (files of the tables it reads, parsed statement), least
+# recently used first
+STATEMENT_CACHE = OrderedDict()
+# prepared statement name -> normalized command text
+PREPARED = {}
+# normalized command text -> (table file -> version, plans chosen on those versions),
+# least recently used first
+PLAN_CACHE = OrderedDict()
+# The plans of the prepared statement being executed, None otherwise
+ACTIVE_PLANS = None
+
+
+def normalize_command(command):
+    return ' '.join(command.split())
+
+
+def cached_statement(command, parse):
+    #Eg: select = cached_statement("id,name from employees where id==2", parse_statement)
+    # parse(text) returns (files of the tables the statement reads, statement); the
+    # statement is shared by every command with the same text, so it must not be changed
+    text = normalize_command(command)
+    cached = STATEMENT_CACHE.get(text)
+    if cached is not None:
+        STATEMENT_CACHE.move_to_end(text)
+        return cached[1]
+    tables, statement = parse(text)
+    STATEMENT_CACHE[text] = (set(tables), statement)
+    while len(STATEMENT_CACHE) > STATEMENT_CACHE_SIZE:
+        STATEMENT_CACHE.popitem(last=False)
+    return statement
+
+
+def forget_statements(filename):
+    # Drops the cached statements and plans that read filename, whose columns, types or
+    # indexes changed; they are parsed and planned again when next run
+    for text in [text for text, (tables, _) in STATEMENT_CACHE.items() if filename in tables]:
+        del STATEMENT_CACHE[text]
+    for text in [text for text, (versions, _) in PLAN_CACHE.items() if filename in versions]:
+        del PLAN_CACHE[text]
+
+
+@contextlib.contextmanager
+def statement_plans(text, versions):
+    #Eg: with statement_plans("id,name from employees where id==?", {'employees.csv': version}): ...
+    # Plans chosen with reuse_plan while the block runs are kept for the text and reused
+    # by its next executions while its tables are at the same versions
+    global ACTIVE_PLANS
+    cached = PLAN_CACHE.get(text)
+    plans = cached[1] if cached is not None and cached[0] == versions else {}
+    ACTIVE_PLANS = plans
+    try:
+        yield
+    finally:
+        ACTIVE_PLANS = None
+    PLAN_CACHE[text] = (versions, plans)
+    PLAN_CACHE.move_to_end(text)
+    while len(PLAN_CACHE) > STATEMENT_CACHE_SIZE:
+        PLAN_CACHE.popitem(last=False)
+
+
+def reuse_plan(key, plan):
+    # The plan the running prepared statement chose for key on an earlier execution,
+    # else plan(), kept for the next; outside an execution plan() every time
+    if ACTIVE_PLANS is None:
+        return plan()
+    if key not in ACTIVE_PLANS:
+        ACTIVE_PLANS[key] = plan()
+    return ACTIVE_PLANS[key]
+
+
+def prepare_statement(name, command):
+    PREPARED[name] = normalize_command(command)
+
+
+def prepared_statement(name):
+    if name not in PREPARED:
+        raise ValueError(f"No prepared statement named {name}")
+    return PREPARED[name]
+
+
+def parameter_count(conditions):
+    # Number of ? values in a parsed where clause
+    if not conditions:
+        return 0
+    if conditions[0] in ('AND', 'OR'):
+        return parameter_count(conditions[1]) + parameter_count(conditions[2])
+    return int(conditions[3] == PARAMETER)
+
+
+def bind_parameters(conditions, values):
+    #Eg: bind_parameters(('CMP', 'id', '==', '?'), ['42']) -> ('CMP', 'id', '==', '42')
+    if parameter_count(conditions) != len(values):
+        raise ValueError(f"Expected {parameter_count(conditions)} parameters, got {len(values)}")
+    values = iter(values)
+
+    def bind(conditions):
+        if conditions[0] in ('AND', 'OR'):
+            return (conditions[0], bind(conditions[1]), bind(conditions[2]))
+        if conditions[3] == PARAMETER:
+            return conditions[:3] + (next(values),)
+        return conditions
+
+    return bind(conditions) if conditions else conditions
+
+
+def condition_shape(conditions):
+    #Eg: condition_shape(('CMP', 'id', '==', '42')) -> ('CMP', 'id', '==', '?')
+    # A where clause without its values, the same for every execution of a statement
+    if not conditions:
+        return conditions
+    if conditions[0] in ('AND', 'OR'):
+        return (conditions[0], condition_shape(conditions[1]), condition_shape(conditions[2]))
+    return conditions[:3] + (PARAMETER,)
@@ -0,0 +1,104 @@
+import os
+import array
+import bisect
+
+from MydbIndex import scan_records
+
+# Tombstones: a delete leaves the table file alone and appends the deleted rows to
+# a side-car file, so its cost depends on the rows deleted rather than the table
+# size; every reader skips them. A CSV table's <table>.tomb holds the (byte offset,
+# length) of each deleted record; a columnar table keeps the numbers of its deleted
+# rows in <table>.cols/deleted. compact <table>, or a delete that leaves more than
+# COMPACT_DEAD_FRACTION of the table's rows dead, rewrites the table without them
+# and removes the tombstones.
+
+COMPACT_DEAD_FRACTION = 0.25
+
+# tombstone file -> ((mtime_ns, size), sorted values)
+TOMBSTONE_CACHE = {}
+
+
+def tombstone_filename(filename):
+    return f"{filename[:-4]}.tomb"
+
+
+def read_tombstones(path, width=1):
+    # The values in the tombstone file, sorted; tuples of width values when width > 1
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return []
+    cached = TOMBSTONE_CACHE.get(path)
+    if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+    values = array.array('Q')
+    with open(path, 'rb') as file:
+        values.frombytes(file.read())
+    values = sorted(values) if width == 1 else sorted(zip(*[iter(values)] * width))
+    TOMBSTONE_CACHE[path] = ((stat.st_mtime_ns, stat.st_size), values)
+    return values
+
+
+def add_tombstones(path, values):
+    # Appends values (ints, or tuples of ints) to the tombstone file
+    flat = array.array('Q')
+    for value in values:
+        if isinstance(value, tuple):
+            flat.extend(value)
+        else:
+            flat.append(value)
+    with open(path, 'ab') as file:
+        flat.tofile(file)
+
+
+def truncate_tombstones(path, size):
+    # Cuts the tombstone file back to its first size bytes
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as file:
+            file.truncate(size)
+    TOMBSTONE_CACHE.pop(path, None)
+
+
+def clear_tombstones(path):
+    if os.path.exists(path):
+        os.remove(path)
+    TOMBSTONE_CACHE.pop(path, None)
+
+
+def dead_spans(filename):
+    # (offset, length) of the deleted records of a CSV table, in file order
+    return read_tombstones(tombstone_filename(filename), 2)
+
+
+def live_ranges(ranges, spans):
+    # The byte ranges with the dead (offset, length) records cut out
+    if not spans:
+        return ranges
+    starts = [offset for offset, _ in spans]
+    live = []
+    for start, end in ranges:
+        position = start
+        for i in range(bisect.bisect_left(starts, start), bisect.bisect_left(starts, end)):
+            offset, length = spans[i]
+            if offset > position:
+                live.append((position, offset))
+            position = max(position, offset + length)
+        if position < end:
+            live.append((position, end))
+    return live
+
+
+def live_offsets(filename, offsets):
+    # The record offsets that are not deleted
+    spans = dead_spans(filename)
+    if not spans:
+        return offsets
+    dead = {offset for offset, _ in spans}
+    return [offset for offset in offsets if offset not in dead]
+
+
+def data_range(filename):
+    # Byte range of a CSV table's records, after the header
+    with open(filename, 'rb') as file:
+        header = next(scan_records(file), None)
+        return (len(header[1]) if header else 0, os.fstat(file.fileno()).st_size)
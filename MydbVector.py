@@ -0,0 +1,348 @@
+import math
+import bisect
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from MydbColumnar import load_meta, column_path, read_column, columnar_dead_rows, INT_NULL, TYPECODES
+from MydbExplain import add_bytes_read
+
+# Vectorized execution over columnar tables, used when NumPy is installed. The
+# fixed-width column files (int, float and dictionary codes) are memory-mapped; a
+# where clause becomes a boolean mask over VECTOR_CHUNK_ROWS rows at a time and
+# group_by sorts each chunk by group and reduces every run with reduceat.
+#
+# Results match the row-at-a-time path exactly: a comparison on a dictionary
+# column is evaluated once per dictionary entry with the row predicate, and the
+# parts NumPy cannot reproduce exactly (string columns, float sums, non-integer
+# cells in aggregates) return None so the caller takes the row path instead.
+
+VECTORIZE = numpy is not None
+VECTOR_CHUNK_ROWS = 1 << 20
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+FIXED_WIDTH = ('int', 'float', 'dict')
+
+
+def vectorized(filename):
+    return VECTORIZE and load_meta(filename)["rows"] > 0
+
+
+def map_column(filename, meta, position):
+    # The column file as an array, without reading it
+    dtype = numpy.dtype(TYPECODES[meta["types"][position]])
+    return numpy.memmap(column_path(filename, position), dtype=dtype, mode='r', shape=(meta["rows"],))
+
+
+def text_number(value):
+    # Same as Mydb.to_number
+    if not value:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def nulls(kind, data):
+    if kind == 'int':
+        return data == INT_NULL
+    if kind == 'float':
+        return numpy.isnan(data)
+    return None
+
+
+def condition_mask(conditions, meta, columns, start, stop, compare, schema=None):
+    # Rows of [start, stop) that may match conditions, or None for all of them; a
+    # mask is exact wherever the column allows it and the caller still filters rows.
+    # compare is Mydb.compile_comparison; columns typed in schema compare as their type.
+    if conditions[0] in ('AND', 'OR'):
+        left = condition_mask(conditions[1], meta, columns, start, stop, compare, schema)
+        right = condition_mask(conditions[2], meta, columns, start, stop, compare, schema)
+        if conditions[0] == 'AND':
+            return right if left is None else left if right is None else left & right
+        return None if left is None or right is None else left | right
+
+    _, field, operator, value = conditions
+    if field not in meta["columns"]:
+        return None
+    position = meta["columns"].index(field)
+    kind = meta["types"][position]
+    if kind not in FIXED_WIDTH:
+        return None
+    data = columns[position][start:stop]
+    add_bytes_read(data.nbytes)
+    try:
+        if kind == 'dict':
+            predicate = compare(field, operator, value, [field], schema)
+            matches = numpy.array([predicate([entry]) for entry in meta["dictionaries"][position]], dtype=bool)
+            return matches[data]
+        if schema and field in schema:
+            return typed_mask(schema[field], kind, data, operator, value)
+        if operator in ('==', '!='):
+            equal = text_equal(kind, data, value)
+            return equal if operator == '==' else ~equal
+        constant = text_number(value)
+    except ValueError:
+        return None  # the row path raises the error
+    if kind == 'int':
+        return int_compare(numpy.where(data == INT_NULL, 0, data), operator, constant)
+    if isinstance(constant, int) and abs(constant) > 2 ** 53:
+        return None  # not exact as a double
+    numbers = numpy.where(numpy.isnan(data), 0.0, data)
+    return {'>': numpy.greater, '<': numpy.less, '>=': numpy.greater_equal,
+            '<=': numpy.less_equal}[operator](numbers, constant)
+
+
+def typed_mask(typed, kind, data, operator, value):
+    # Cells of a column typed typed matching the comparison as Mydb.compile_typed_comparison
+    # decides it: NULL matches nothing and an int column compares exactly with any
+    # number. None when the column is not stored as its type.
+    present = ~nulls(kind, data)
+    if typed == 'int' and kind == 'int':
+        constant = text_number(value)
+        if operator in ('==', '!='):
+            equal = int_compare(data, '>=', constant) & int_compare(data, '<=', constant)
+            return present & (equal if operator == '==' else ~equal)
+        return present & int_compare(data, operator, constant)
+    if typed == 'float' and kind == 'float':
+        return present & {'==': numpy.equal, '!=': numpy.not_equal, '>': numpy.greater, '<': numpy.less,
+                          '>=': numpy.greater_equal, '<=': numpy.less_equal}[operator](data, float(value))
+    return None
+
+
+def text_equal(kind, data, value):
+    # Cells whose text, '0' when empty, equals value; a stored cell's text is the
+    # canonical form of its number, so other spellings of value never match
+    empty = nulls(kind, data) if value == '0' else numpy.zeros(len(data), dtype=bool)
+    if kind == 'int':
+        try:
+            number = int(value)
+        except ValueError:
+            return empty
+        if str(number) != value or not INT64_MIN < number <= INT64_MAX:
+            return empty
+        return empty | (data == number)
+    try:
+        number = float(value)
+    except ValueError:
+        return empty
+    if not math.isfinite(number) or repr(number) != value:
+        return empty
+    # 0.0 and -0.0 are equal numbers with different text
+    return empty | ((data == number) & (numpy.signbit(data) == (math.copysign(1.0, number) < 0)))
+
+
+def int_compare(numbers, operator, constant):
+    # numbers <operator> constant, exact for any int or float constant
+    if isinstance(constant, float):
+        if constant != constant:
+            return numpy.zeros(len(numbers), dtype=bool)
+        if math.isinf(constant):
+            below = (constant > 0) == (operator in ('<', '<='))
+            return numpy.full(len(numbers), below, dtype=bool)
+        # Between integers: x > 2.5 is x > 2 and x >= 2.5 is x >= 3
+        constant = math.floor(constant) if operator in ('>', '<=') else math.ceil(constant)
+    if constant > INT64_MAX or constant < INT64_MIN:
+        below = (constant > 0) == (operator in ('<', '<='))
+        return numpy.full(len(numbers), below, dtype=bool)
+    return {'>': numpy.greater, '<': numpy.less, '>=': numpy.greater_equal,
+            '<=': numpy.less_equal}[operator](numbers, constant)
+
+
+def live_mask(dead, start, stop):
+    # Rows of [start, stop) that are not deleted, or None when all of them are live
+    lo, hi = bisect.bisect_left(dead, start), bisect.bisect_left(dead, stop)
+    if lo == hi:
+        return None
+    mask = numpy.ones(stop - start, dtype=bool)
+    mask[numpy.array(dead[lo:hi], dtype=numpy.int64) - start] = False
+    return mask
+
+
+def decode_cells(kind, values, dictionary):
+    # Text of the given column values (a NumPy array)
+    if kind == 'int':
+        return ['' if value == INT_NULL else str(value) for value in values.tolist()]
+    if kind == 'float':
+        return ['' if value != value else repr(value) for value in values.tolist()]
+    return list(map(dictionary.__getitem__, values.tolist()))
+
+
+def vector_rows(filename, conditions, columns, compare):
+    # Like columnar_rows, but only the rows the where clause mask keeps are decoded
+    meta = load_meta(filename)
+    width = len(meta["columns"])
+    mapped = {position: map_column(filename, meta, position)
+              for position in range(width) if meta["types"][position] in FIXED_WIDTH}
+    wanted = range(width) if columns is None else {meta["columns"].index(c) for c in columns if c in meta["columns"]}
+    dead = columnar_dead_rows(filename)
+    for start in range(0, meta["rows"], VECTOR_CHUNK_ROWS):
+        stop = min(meta["rows"], start + VECTOR_CHUNK_ROWS)
+        mask = condition_mask(conditions, meta, mapped, start, stop, compare, meta.get("schema"))
+        live = live_mask(dead, start, stop)
+        if live is not None:
+            mask = live if mask is None else mask & live
+        selected = numpy.arange(stop - start) if mask is None else numpy.flatnonzero(mask)
+        if not len(selected):
+            continue
+        cells = []
+        for position in range(width):
+            if position not in wanted:
+                cells.append([''] * len(selected))
+            elif position in mapped:
+                add_bytes_read(len(selected) * mapped[position].itemsize)
+                cells.append(decode_cells(meta["types"][position], mapped[position][start:stop][selected],
+                                          meta["dictionaries"][position]))
+            else:
+                values = read_column(filename, meta, position, start, stop)
+                cells.append([values[i] for i in selected.tolist()])
+        yield from map(list, zip(*cells))
+
+
+def integer_entries(dictionary):
+    # The dictionary as the numbers the row path aggregates (empty cells are 0), or
+    # None when an entry is not an integer
+    try:
+        numbers = [int(entry) if entry else 0 for entry in dictionary]
+    except ValueError:
+        return None
+    if any(not INT64_MIN <= number <= INT64_MAX for number in numbers):
+        return None
+    return numpy.array(numbers, dtype=numpy.int64)
+
+
+def aggregate_numbers(meta, position, data):
+    if meta["types"][position] == 'dict':
+        return integer_entries(meta["dictionaries"][position])[data]
+    return numpy.where(data == INT_NULL, 0, data)
+
+
+def non_empty(meta, position, data):
+    kind = meta["types"][position]
+    if kind == 'dict':
+        return numpy.array([entry != '' for entry in meta["dictionaries"][position]], dtype=bool)[data]
+    return ~nulls(kind, data)
+
+
+def vector_aggregatable(filename, plan):
+    # True when every column the plan needs can be aggregated exactly here
+    if not vectorized(filename):
+        return False
+    meta = load_meta(filename)
+    types = meta["types"]
+    needed = plan["keys"] + plan["numeric"] + plan["counted"] + plan["distinct"]
+    if any(types[position] not in FIXED_WIDTH for position in needed):
+        return False
+    for position, kind in zip(plan["numeric"], plan["types"]):
+        if types[position] == 'float' or kind not in (None, 'int'):
+            return False  # float sums depend on the order they are added in
+        if types[position] == 'dict' and integer_entries(meta["dictionaries"][position]) is None:
+            return False
+    return True
+
+
+def vector_groups(filename, plan, new_group_state):
+    # The group states of Mydb.group_rows for a columnar table, or None when a
+    # column the plan needs cannot be aggregated exactly here
+    if not vector_aggregatable(filename, plan):
+        return None
+    meta = load_meta(filename)
+    needed = plan["keys"] + plan["numeric"] + plan["counted"] + plan["distinct"]
+    mapped = {position: map_column(filename, meta, position) for position in set(needed)}
+
+    dead = columnar_dead_rows(filename)
+    groups = {}
+    for start in range(0, meta["rows"], VECTOR_CHUNK_ROWS):
+        stop = min(meta["rows"], start + VECTOR_CHUNK_ROWS)
+        chunk = {p: data[start:stop] for p, data in mapped.items()}
+        add_bytes_read(sum(data.nbytes for data in chunk.values()))
+        live = live_mask(dead, start, stop)
+        if live is not None:
+            chunk = {p: data[live] for p, data in chunk.items()}
+        rows = stop - start if live is None else int(live.sum())
+        if rows:
+            aggregate_vector_chunk(meta, plan, chunk, rows, groups, new_group_state)
+    return groups
+
+
+def key_codes(kind, data):
+    # Values to group a key column by; floats by their bits so 0.0 and -0.0 differ
+    return data.view(numpy.int64) if kind == 'float' else data
+
+
+def aggregate_vector_chunk(meta, plan, data, rows, groups, new_group_state):
+    types, dictionaries = meta["types"], meta["dictionaries"]
+    # Number the groups 0..count-1; first is the row each group first appears in
+    group = numpy.zeros(rows, dtype=numpy.int64)
+    for position in plan["keys"]:
+        values, codes = numpy.unique(key_codes(types[position], data[position]), return_inverse=True)
+        group = group * len(values) + codes.reshape(-1)
+    _, first, group = numpy.unique(group, return_index=True, return_inverse=True)
+    group = group.reshape(-1)
+    count = len(first)
+
+    order = numpy.argsort(group, kind='stable')
+    sizes = numpy.bincount(group, minlength=count)
+    slots = []
+    for position, kind in zip(plan["numeric"], plan["types"]):
+        numbers = aggregate_numbers(meta, position, data[position])[order]
+        if kind is None:
+            slots.append((sizes.tolist(),) + reduce_runs(numbers, sizes))
+        else:
+            # Typed columns skip NULLs
+            kept = non_empty(meta, position, data[position])
+            slot_sizes = numpy.bincount(group[kept], minlength=count)
+            slots.append((slot_sizes.tolist(),) + reduce_runs(numbers[kept[order]], slot_sizes))
+    counted = [numpy.bincount(group[non_empty(meta, p, data[p])], minlength=count).tolist() for p in plan["counted"]]
+    distinct = [distinct_values(meta, p, data[p], group, count) for p in plan["distinct"]]
+
+    keys = [decode_cells(types[p], data[p][first], dictionaries[p]) for p in plan["keys"]]
+    sizes = sizes.tolist()
+    # New groups are added in the order they first appear, as in the row path
+    for g in numpy.argsort(first, kind='stable').tolist():
+        key = tuple(cells[g] for cells in keys)
+        state = groups.get(key)
+        if state is None:
+            state = groups[key] = new_group_state(plan)
+        state[0] += sizes[g]
+        for j, (slot_sizes, sums, mins, maxs) in enumerate(slots):
+            if slot_sizes[g]:
+                state[1][j] += sums[g]
+                state[2][j] = mins[g] if state[2][j] is None else min(state[2][j], mins[g])
+                state[3][j] = maxs[g] if state[3][j] is None else max(state[3][j], maxs[g])
+                state[6][j] += slot_sizes[g]
+        for j, counts in enumerate(counted):
+            state[4][j] += counts[g]
+        for j, values in enumerate(distinct):
+            state[5][j].update(values[g])
+
+
+def reduce_runs(numbers, sizes):
+    # (sums, mins, maxs) of the consecutive runs of numbers, run g being sizes[g]
+    # long; None for an empty run
+    present = numpy.flatnonzero(sizes)
+    starts = numpy.concatenate(([0], numpy.cumsum(sizes[present])[:-1])).astype(numpy.int64)
+    if len(numbers) and max(abs(int(numbers.min())), abs(int(numbers.max()))) * len(numbers) > INT64_MAX:
+        numbers = numbers.astype(object)  # Python ints cannot overflow
+    results = []
+    for reduce in (numpy.add, numpy.minimum, numpy.maximum):
+        values = [None] * len(sizes)
+        if len(present):
+            for g, value in zip(present.tolist(), reduce.reduceat(numbers, starts).tolist()):
+                values[g] = value
+        results.append(values)
+    return tuple(results)
+
+
+def distinct_values(meta, position, data, group, count):
+    # Per group, the set of non-empty cell texts of the column
+    kept = non_empty(meta, position, data)
+    data = data[kept]
+    values, first, codes = numpy.unique(key_codes(meta["types"][position], data), return_index=True, return_inverse=True)
+    texts = decode_cells(meta["types"][position], data[first], meta["dictionaries"][position])
+    sets = [set() for _ in range(count)]
+    for pair in numpy.unique(group[kept] * len(values) + codes.reshape(-1)).tolist():
+        sets[pair // len(values)].add(texts[pair % len(values)])
+    return sets
@@ -0,0 +1,158 @@
+import os
+import json
+import zlib
+import time
+import struct
+import threading
+
+# Write-ahead log: insert_into and delete append a record to WAL_FILE before they
+# change a table. A record is a 4-byte payload length, the payload's CRC32 and the
+# payload (JSON); reading stops at the first torn or corrupt record, which is where
+# a crash cut the log.
+#
+# Records are made durable in groups: append returns only once its record is synced,
+# and one fsync covers every record written before it started, so appends made while
+# an fsync runs (from other threads) share the next one. A checkpoint syncs the
+# tables the log touched and starts a new, empty log.
+
+WAL_FILE = 'mydb.wal'
+# Records a group syncs at once without waiting out WAL_GROUP_COMMIT_SECONDS
+WAL_GROUP_COMMIT_RECORDS = 1024
+# How long the first record of a group waits for others to join it before its
+# fsync; 0 syncs at once, which a single writer always wants
+WAL_GROUP_COMMIT_SECONDS = 0
+# Log size past which the next mutation checkpoints
+WAL_CHECKPOINT_BYTES = 64 * 1024 * 1024
+RECORD_HEADER = struct.Struct('<II')
+
+
+class WriteAheadLog:
+    """
+    Append-only log with group commit. append writes a record and returns once an
+    fsync covers it: the first waiting append syncs every record written so far,
+    after waiting up to group_seconds for group_records of them, while appends made
+    during its fsync wait for the next one. tables holds the tables that have
+    records in the log.
+    """
+
+    def __init__(self, path=None, group_records=None, group_seconds=None):
+        self.path = os.path.abspath(path or WAL_FILE)
+        self.group_records = group_records or WAL_GROUP_COMMIT_RECORDS
+        self.group_seconds = WAL_GROUP_COMMIT_SECONDS if group_seconds is None else group_seconds
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.file = open(self.path, 'ab')
+        self.tables = set()
+        # Records written and records known durable, counted from the start
+        self.written = 0
+        self.synced = 0
+        self.syncing = False
+        self.syncs = 0
+
+    def append(self, record):
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        with self.lock:
+            self.file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.file.flush()
+            self.written += 1
+            if self.written - self.synced >= self.group_records:
+                self.changed.notify_all()
+            self.wait_synced(self.written)
+
+    def wait_synced(self, sequence):
+        # Returns once the first sequence records are durable, syncing them if no
+        # other thread is
+        while self.synced < sequence:
+            if self.syncing:
+                self.changed.wait()
+                continue
+            self.syncing = True
+            try:
+                deadline = time.monotonic() + self.group_seconds
+                while self.written - self.synced < self.group_records and time.monotonic() < deadline:
+                    self.changed.wait(deadline - time.monotonic())
+                self.sync_locked()
+            finally:
+                self.syncing = False
+                self.changed.notify_all()
+
+    def sync_locked(self):
+        # Syncs the records written so far; appends may go on during the fsync
+        target = self.written
+        if target == self.synced:
+            return 0
+        self.lock.release()
+        try:
+            os.fsync(self.file.fileno())
+        finally:
+            self.lock.acquire()
+        waiting, self.synced = target - self.synced, max(self.synced, target)
+        self.syncs += 1
+        return waiting
+
+    def sync(self):
+        # Makes every record written so far durable; returns how many were waiting
+        with self.lock:
+            waiting = self.written - self.synced
+            self.wait_synced(self.written)
+            return waiting
+
+    def size(self):
+        return self.file.tell()
+
+    def reset(self):
+        # Replaces the log with an empty one; the tables must already be synced
+        with self.lock:
+            while self.synced < self.written:
+                self.wait_synced(self.written)
+            self.file.close()
+            with open(self.path + '.tmp', 'wb') as file:
+                os.fsync(file.fileno())
+            os.replace(self.path + '.tmp', self.path)
+            sync_directory(os.path.dirname(self.path))
+            self.file = open(self.path, 'ab')
+            self.tables = set()
+
+    def close(self):
+        with self.lock:
+            while self.synced < self.written:
+                self.wait_synced(self.written)
+            self.file.close()
+
+
+def read_wal(path=None):
+    # The records of the log, up to the first torn or corrupt one
+    path = path or WAL_FILE
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as file:
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                print("Write-ahead log ends in a torn record; ignoring it")
+                return
+            yield json.loads(payload)
+
+
+def sync_file(path):
+    if os.path.exists(path):
+        with open(path, 'r+b') as file:
+            os.fsync(file.fileno())
+
+
+def sync_directory(path):
+    # Makes new and renamed entries of the directory durable, where the OS allows it
+    try:
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
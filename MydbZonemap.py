@@ -0,0 +1,267 @@
+import os
+import io
+import csv
+import json
+import bisect
+
+from MydbIndex import scan_records, decode_record, numeric_key
+from MydbExplain import add_bytes_read, add_memory
+
+# Zone maps: the records of a table are grouped into blocks of ZONEMAP_BLOCK_ROWS
+# rows, and <table>.zonemap records each block's byte range, row count and, per
+# column, [numeric min, numeric max, text min, text max]. Empty cells count as 0
+# (or '0' as text) just as in where clauses; the numeric bounds are None when the
+# block holds a non-numeric value. A scan only reads the blocks whose bounds
+# leave a where clause a chance to match.
+#
+# The side-car stores the table's size and mtime; a zone map that no longer
+# matches the table is rebuilt on next use. Appends extend the last block and
+# deletes shift the byte ranges, keeping the old bounds, which stay valid.
+
+ZONEMAP_BLOCK_ROWS = 1024
+
+# zonemap file -> zone map, trusted while its recorded size/mtime match the table
+ZONEMAP_CACHE = {}
+
+
+def zonemap_filename(filename):
+    return f"{filename[:-4]}.zonemap"
+
+
+def column_zone(cells):
+    texts = [cell or '0' for cell in cells]
+    try:
+        numbers = [numeric_key(cell) for cell in cells]
+        if any(number != number for number in numbers):
+            raise ValueError
+        low, high = min(numbers), max(numbers)
+    except ValueError:
+        low = high = None
+    return [low, high, min(texts), max(texts)]
+
+
+def merge_zone(zone, other):
+    if zone[0] is None or other[0] is None:
+        low = high = None
+    else:
+        low, high = min(zone[0], other[0]), max(zone[1], other[1])
+    return [low, high, min(zone[2], other[2]), max(zone[3], other[3])]
+
+
+def make_block(start, raws, width):
+    data = b''.join(raws)
+    rows = list(csv.reader(io.StringIO(data.decode('utf-8'), newline='')))
+    rows = [row if len(row) >= width else row + [''] * (width - len(row)) for row in rows]
+    return {"start": start, "end": start + len(data), "rows": len(rows),
+            "zones": [column_zone(cells) for cells in zip(*rows)] if rows else []}
+
+
+def collect_blocks(records, width, block_rows=None):
+    # Groups (offset, raw record) pairs into blocks
+    block_rows = block_rows or ZONEMAP_BLOCK_ROWS
+    blocks, start, pending = [], None, []
+    for offset, raw in records:
+        if start is None:
+            start = offset
+        pending.append(raw)
+        if len(pending) >= block_rows:
+            blocks.append(make_block(start, pending, width))
+            start, pending = None, []
+    if pending:
+        blocks.append(make_block(start, pending, width))
+    return blocks
+
+
+def build_zonemap(filename):
+    with open(filename, 'rb') as file:
+        records = scan_records(file)
+        header = next(records, None)
+        columns = decode_record(header[1]) if header else []
+        blocks = collect_blocks(records, len(columns))
+    zonemap = {"columns": columns, "blocks": blocks}
+    save_zonemap(filename, zonemap)
+    return zonemap
+
+
+def save_zonemap(filename, zonemap):
+    stat = os.stat(filename)
+    zonemap["bytes"], zonemap["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+    path = zonemap_filename(filename)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(zonemap, file)
+    os.replace(path + '.tmp', path)
+    ZONEMAP_CACHE[path] = zonemap
+
+
+def load_zonemap(filename, build=True):
+    # The table's zone map, rebuilt when missing or stale unless build is False
+    path = zonemap_filename(filename)
+    zonemap = ZONEMAP_CACHE.get(path)
+    if zonemap is None and os.path.exists(path):
+        with open(path, 'r') as file:
+            zonemap = json.load(file)
+    if zonemap is not None:
+        stat = os.stat(filename)
+        if (stat.st_size, stat.st_mtime_ns) == (zonemap["bytes"], zonemap["mtime_ns"]):
+            ZONEMAP_CACHE[path] = zonemap
+            return zonemap
+    return build_zonemap(filename) if build else None
+
+
+def zone_may_match(conditions, positions, zones):
+    # False only when the block bounds prove no row can satisfy the where clause
+    if not conditions:
+        return True
+    if conditions[0] == 'AND':
+        return zone_may_match(conditions[1], positions, zones) and zone_may_match(conditions[2], positions, zones)
+    if conditions[0] == 'OR':
+        return zone_may_match(conditions[1], positions, zones) or zone_may_match(conditions[2], positions, zones)
+
+    _, field, operator, value = conditions
+    if field not in positions:
+        return True
+    low, high, text_low, text_high = zones[positions[field]]
+    if operator == '!=':
+        return not (text_low == text_high == value)
+    if operator == '==' and not text_low <= value <= text_high:
+        return False
+    if low is None:
+        return True
+    try:
+        constant = numeric_key(value)
+    except ValueError:
+        return operator != '=='  # a numeric block holds no equal text
+    if operator == '==':
+        return low <= constant <= high
+    if operator == '>':
+        return high > constant
+    if operator == '>=':
+        return high >= constant
+    if operator == '<':
+        return low < constant
+    if operator == '<=':
+        return low <= constant
+    return True
+
+
+def candidate_blocks(filename, conditions):
+    # Blocks that may hold rows matching conditions, in file order
+    zonemap = load_zonemap(filename)
+    positions = {column: i for i, column in enumerate(zonemap["columns"])}
+    return [block for block in zonemap["blocks"]
+            if block["rows"] and zone_may_match(conditions, positions, block["zones"])]
+
+
+def skips_blocks(filename, conditions):
+    # True when the zone map rules out at least one block holding rows
+    return len(candidate_blocks(filename, conditions)) < sum(1 for block in load_zonemap(filename)["blocks"] if block["rows"])
+
+
+def merge_ranges(blocks):
+    # Byte ranges (start, end) of blocks, with adjacent blocks merged into one range
+    ranges = []
+    for block in blocks:
+        if ranges and ranges[-1][1] == block["start"]:
+            ranges[-1] = (ranges[-1][0], block["end"])
+        else:
+            ranges.append((block["start"], block["end"]))
+    return ranges
+
+
+def candidate_ranges(filename, conditions):
+    return merge_ranges(candidate_blocks(filename, conditions))
+
+
+def split_ranges(filename, conditions, parts):
+    # Candidate blocks cut into at most parts runs of consecutive blocks with about the
+    # same number of bytes, each given as its byte ranges. Block boundaries are record
+    # boundaries, so a quoted newline never splits a record between two parts.
+    blocks = candidate_blocks(filename, conditions)
+    total = sum(block["end"] - block["start"] for block in blocks)
+    groups, current, size = [], [], 0
+    for block in blocks:
+        current.append(block)
+        size += block["end"] - block["start"]
+        if size * parts >= total * (len(groups) + 1) and len(groups) < parts - 1:
+            groups.append(merge_ranges(current))
+            current = []
+    if current:
+        groups.append(merge_ranges(current))
+    return groups
+
+
+def read_ranges(filename, ranges):
+    # Rows (lists) stored in the given byte ranges of the table
+    with open(filename, 'rb') as file:
+        for start, end in ranges:
+            file.seek(start)
+            data = file.read(end - start).decode('utf-8')
+            add_bytes_read(end - start)
+            add_memory(end - start)
+            yield from csv.reader(io.StringIO(data, newline=''))
+
+
+def read_range_records(filename, ranges):
+    # (offset, length, row) of every record in the given byte ranges; records are
+    # decoded a block at a time
+    with open(filename, 'rb') as file:
+        for start, end in ranges:
+            batch = []
+            for offset, raw in scan_records(file, start):
+                if offset >= end:
+                    break
+                batch.append((offset, raw))
+                if len(batch) >= ZONEMAP_BLOCK_ROWS:
+                    yield from decode_batch(batch)
+                    batch = []
+            yield from decode_batch(batch)
+
+
+def decode_batch(batch):
+    data = b''.join(raw for _, raw in batch).decode('utf-8')
+    rows = csv.reader(io.StringIO(data, newline=''))
+    return [(offset, len(raw), row) for (offset, raw), row in zip(batch, rows)]
+
+
+def zonemap_append(filename, zonemap, start_offset):
+    # Extends zonemap, loaded before the append, with the records appended from start_offset
+    if zonemap is None:
+        return
+    blocks = zonemap["blocks"]
+    width = len(zonemap["columns"])
+    with open(filename, 'rb') as file:
+        records = list(scan_records(file, start_offset))
+
+    last = blocks[-1] if blocks else None
+    if last is not None and last["end"] == start_offset and last["rows"] < ZONEMAP_BLOCK_ROWS:
+        fill = ZONEMAP_BLOCK_ROWS - last["rows"]
+        extra = make_block(start_offset, [raw for _, raw in records[:fill]], width)
+        if extra["rows"]:
+            last["zones"] = [merge_zone(a, b) for a, b in zip(last["zones"], extra["zones"])] if last["zones"] else extra["zones"]
+            last["end"], last["rows"] = extra["end"], last["rows"] + extra["rows"]
+        records = records[fill:]
+    blocks.extend(collect_blocks(records, width))
+    save_zonemap(filename, zonemap)
+
+
+def zonemap_remove(filename, zonemap, spans):
+    # Shifts the block ranges of zonemap, loaded before the delete, after the
+    # (offset, length) records were cut out of the table
+    if zonemap is None:
+        return
+    spans = sorted(spans)
+    starts = [offset for offset, _ in spans]
+    # shifted[i] is the bytes removed by the first i spans
+    shifted = [0]
+    for _, length in spans:
+        shifted.append(shifted[-1] + length)
+
+    blocks = []
+    for block in zonemap["blocks"]:
+        first, last = bisect.bisect_left(starts, block["start"]), bisect.bisect_left(starts, block["end"])
+        block["start"], block["end"] = block["start"] - shifted[first], block["end"] - shifted[last]
+        block["rows"] -= last - first
+        if block["rows"] > 0:
+            blocks.append(block)
+    zonemap["blocks"] = blocks
+    save_zonemap(filename, zonemap)
@@ -0,0 +1,65 @@
+import io
+import os
+import sys
+import contextlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Mydb
+import MydbCatalog
+import MydbColumnar
+import MydbIndex
+import MydbResultCache
+import MydbStatements
+import MydbTombstone
+import MydbZonemap
+
+
+def reset_state():
+    # Module state that outlives a command: the log, queued inserts and the caches
+    Mydb.WAL = None
+    Mydb.PENDING_INSERTS.clear()
+    MydbCatalog.CATALOG.clear()
+    MydbCatalog.CATALOG_LOADED = False
+    for cache in (MydbColumnar.META_CACHE, MydbIndex.INDEX_CACHE, MydbIndex.HEADER_CACHE,
+                  MydbTombstone.TOMBSTONE_CACHE, MydbZonemap.ZONEMAP_CACHE,
+                  MydbStatements.STATEMENT_CACHE, MydbStatements.PREPARED, MydbStatements.PLAN_CACHE,
+                  MydbResultCache.TABLE_VERSIONS):
+        cache.clear()
+    MydbResultCache.enable_result_cache(0)
+    MydbResultCache.clear_result_cache()
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # Every test runs in an empty directory with fresh module state
+    monkeypatch.chdir(tmp_path)
+    reset_state()
+    yield tmp_path
+    Mydb.close_wal()
+    reset_state()
+
+
+@pytest.fixture
+def run():
+    # run(command) -> (what process_command returned, what it printed)
+    def run(command):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = Mydb.process_command(command)
+        return result, output.getvalue()
+    return run
+
+
+def write_table(filename, header, rows):
+    with open(filename, 'w', newline='') as file:
+        file.write(','.join(header) + '\n')
+        for row in rows:
+            file.write(','.join(map(str, row)) + '\n')
+
+
+def read_rows(filename):
+    with open(filename, newline='') as file:
+        return [line.rstrip('\r\n').split(',') for line in file][1:]
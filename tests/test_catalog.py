@@ -0,0 +1,57 @@
+import MydbCatalog
+from conftest import write_table
+
+
+def stats(column):
+    return MydbCatalog.table_stats('people.csv')["stats"][column]
+
+
+def test_analyze_counts_rows_nulls_ranges_and_distinct_values(run):
+    write_table('people.csv', ['id', 'name', 'age'],
+                [(i, f"p{i % 500}", '' if i % 10 == 0 else 20 + i % 40) for i in range(1, 2001)])
+    table = MydbCatalog.table_stats('people.csv')
+    assert (table["rows"], table["columns"]) == (2000, ['id', 'name', 'age'])
+    assert (stats('age')["nulls"], stats('age')["non_numeric"]) == (200, 0)
+    assert MydbCatalog.column_range('people.csv', 'id') == (1, 2000)
+    assert MydbCatalog.column_range('people.csv', 'name') == ('p0', 'p99')
+    assert stats('id')["ascending"] and not stats('age')["ascending"]
+    assert abs(MydbCatalog.distinct_count('people.csv', 'id') - 2000) < 200
+    assert abs(MydbCatalog.distinct_count('people.csv', 'name') - 500) < 50
+
+
+def test_writes_keep_the_entry_without_analyzing(run, monkeypatch):
+    run('create_table people id:int,name,age:int')
+    run('insert_into people ' + ';'.join(f'id={i},name=p{i},age={i % 30 or ""}' for i in range(1, 101)))
+    run('select id from people where id==1')
+
+    def analyze_table(filename):
+        raise AssertionError(f"{filename} analyzed again")
+
+    monkeypatch.setattr(MydbCatalog, 'analyze_table', analyze_table)
+    run('insert_into people id=200,name=late,age=')
+    run('select id from people where id==1')
+    assert MydbCatalog.table_stats('people.csv')["rows"] == 101
+    assert stats('age')["nulls"] == 4
+    assert MydbCatalog.column_range('people.csv', 'id') == (1, 200)
+    # A typed NULL is not 0, so only the two ids go
+    run('delete from people where age==0 OR id<3')
+    assert MydbCatalog.table_stats('people.csv')["rows"] == 99
+    assert stats('age')["nulls"] == 4
+    assert MydbCatalog.catalog_schema('people.csv') == {'id': 'int', 'age': 'int'}
+
+
+def test_catalog_is_persisted_and_notices_outside_changes(run):
+    run('create_table people id:int,name')
+    run('insert_into people id=1,name=a;id=2,name=b')
+    run('select id from people')
+    MydbCatalog.CATALOG.clear()
+    MydbCatalog.CATALOG_LOADED = False
+    assert MydbCatalog.table_stats('people.csv')["rows"] == 2
+    assert MydbCatalog.catalog_schema('people.csv') == {'id': 'int'}
+
+    with open('people.csv', 'a') as file:
+        file.write('3,c\n4,\n')
+    assert MydbCatalog.table_stats('people.csv')["rows"] == 4
+    assert stats('name')["nulls"] == 1
+    # Analyzing again keeps the column types
+    assert MydbCatalog.catalog_schema('people.csv') == {'id': 'int'}
@@ -0,0 +1,59 @@
+import ast
+import csv
+import os
+
+from MydbColumnar import load_meta, columnar_dir, columnar_dead_rows, DICT_MAX_ENTRIES
+
+
+def rows(run, table):
+    return [ast.literal_eval(line) for line in run(f'select * from {table}')[1].splitlines()]
+
+
+def types(run):
+    # Inserted rows reach the column files before the next command runs
+    run('select id from t LIMIT 1')
+    return load_meta('t.csv')["types"]
+
+
+def test_convert_round_trip_keeps_every_cell(run):
+    # Text that only looks numeric ('007', '1e3', '-0.0') must come back as written
+    cells = [(i, ['007', '1e3', '-0.0', '', 'x'][i % 5], i / 4, f"s{i % 3}", '' if i % 7 else 'note, "quoted"')
+             for i in range(1, 60)]
+    with open('t.csv', 'w', newline='') as file:
+        csv.writer(file).writerows([['id', 'code', 'ratio', 'tag', 'note']] + cells)
+    with open('t.csv', 'rb') as file:
+        original = file.read()
+    before = rows(run, 't')
+    assert run('convert t columnar')[0] == "Converted t.csv to columnar (59 rows)."
+    assert not os.path.exists('t.csv') and os.path.isdir(columnar_dir('t.csv'))
+    assert load_meta('t.csv')["types"] == ['int', 'dict', 'float', 'dict', 'dict']
+    assert rows(run, 't') == before
+    assert run('convert t columnar')[0] == "Table t.csv is already stored as columnar."
+    assert run('convert t csv')[0] == "Converted t.csv to csv (59 rows)."
+    with open('t.csv', 'rb') as file:
+        assert file.read() == original
+
+
+def test_columns_widen_as_values_arrive(run):
+    assert run('create_table t id:int,v columnar')[0] == "Columnar table t created with columns id, v."
+    run('insert_into t id=1,v=5;id=2,v=6')
+    assert types(run) == ['int', 'int']
+    run('insert_into t id=3,v=five')
+    assert types(run) == ['int', 'dict']
+    run('insert_into t ' + ';'.join(f'id={i},v=w{i}' for i in range(4, DICT_MAX_ENTRIES + 10)))
+    assert types(run) == ['int', 'str']
+    values = [row['v'] for row in rows(run, 't')]
+    assert values == ['5', '6', 'five'] + [f"w{i}" for i in range(4, DICT_MAX_ENTRIES + 10)]
+    assert load_meta('t.csv')["schema"] == {'id': 'int'}
+
+
+def test_columnar_deletes_and_compaction(run):
+    run('create_table t id:int,v columnar')
+    run('insert_into t ' + ';'.join(f'id={i},v=v{i}' for i in range(1, 21)))
+    run('delete from t where id==3 OR id==7')
+    assert columnar_dead_rows('t.csv') == [2, 6]
+    assert [row['id'] for row in rows(run, 't')] == [str(i) for i in range(1, 21) if i not in (3, 7)]
+    assert run('compact t')[0] == "Compacted t.csv (2 deleted rows removed)."
+    assert columnar_dead_rows('t.csv') == [] and load_meta('t.csv')["rows"] == 18
+    run('insert_into t id=21,v=late')
+    assert rows(run, 't')[-2:] == [{'id': '20', 'v': 'v20'}, {'id': '21', 'v': 'late'}]
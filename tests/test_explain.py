@@ -0,0 +1,57 @@
+import os
+
+import MydbExplain
+import MydbSort
+import MydbZonemap
+from conftest import write_table
+
+
+def make_table(monkeypatch):
+    monkeypatch.setattr(MydbZonemap, 'ZONEMAP_BLOCK_ROWS', 100)
+    write_table('t.csv', ['id', 'v'], [(i, i % 10) for i in range(1, 1001)])
+
+
+def test_explain_shows_the_plan_without_running_it(run, monkeypatch):
+    make_table(monkeypatch)
+    result, output = run('explain select id from t where v==3 ORDER_BY id DESC')
+    assert result.splitlines() == [f"Sort (id DESC; external, memory budget {MydbSort.SORT_MEMORY_BUDGET} bytes)",
+                                   "  -> Filter (v==3; id)",
+                                   "    -> SeqScan (t.csv)"]
+    assert output == ""
+    assert not os.path.exists('order_by_result.csv')
+    assert run('explain delete from t where id==1')[0] == "Only select and execute commands can be explained"
+
+
+def test_explain_analyze_counts_rows_and_bytes(run, monkeypatch):
+    make_table(monkeypatch)
+    reports = []
+
+    def hook(command, operators):
+        reports.append((command, operators))
+
+    MydbExplain.add_explain_hook(hook)
+    try:
+        lines = run('explain analyze select id from t where v==3')[0].splitlines()
+        assert lines[0].startswith("Filter (v==3; id)  rows in=1000 out=100")
+        assert lines[-1] == "Select query executed."
+        command, operators = reports[-1]
+        assert command == 'select id from t where v==3'
+        scan = operators[-1]
+        assert (scan["operator"], scan["rows_out"], scan["bytes_read"]) == ("SeqScan", 1000, os.path.getsize('t.csv'))
+        assert scan["peak_memory"] is not None
+
+        # The zone map reads only the blocks that can match
+        run('explain analyze select id from t where id>950')
+        scan = reports[-1][1][-1]
+        assert scan["operator"] == "ZoneMapScan" and 0 < scan["bytes_read"] < os.path.getsize('t.csv') / 5
+
+        # While a hook is registered plain selects are counted too, without memory
+        assert run('select id from t where id==5') == ("Select query executed.", "{'id': '5'}\n")
+        command, operators = reports[-1]
+        assert command == 'select id from t where id==5'
+        assert operators[0]["rows_out"] == 1 and operators[0]["peak_memory"] is None
+    finally:
+        MydbExplain.remove_explain_hook(hook)
+    count = len(reports)
+    run('select id from t where id==5')
+    assert len(reports) == count
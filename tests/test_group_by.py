@@ -0,0 +1,29 @@
+import Mydb
+from conftest import write_table
+
+EMPLOYEES = [(1, 'Alice', 'HR', 100000), (2, 'Bob', 'Sales', 120000), (3, 'Charlie', 'IT', 80000),
+             (4, 'David', 'Marketing', 95000), (5, 'Eve', 'Finance', 25000), (10, 'Jane', 'Finance', 130000)]
+
+
+def make_employees():
+    write_table('employees.csv', ['id', 'name', 'department', 'salary'], EMPLOYEES)
+
+
+def test_having_compares_aggregates_as_numbers(run):
+    make_employees()
+    query = 'select department,AVG(salary),COUNT() from employees group_by department having '
+    assert run(query + 'AVG(salary)==77500')[1] == "Finance: AVG(salary) = 77500.0, COUNT() = 2\n"
+    assert run(query + 'COUNT()==2.0')[1] == "Finance: AVG(salary) = 77500.0, COUNT() = 2\n"
+    assert run(query + 'AVG(salary)>=100000 AND department!=Sales')[1] == "HR: AVG(salary) = 100000.0, COUNT() = 1\n"
+    assert run(query + 'MAX(salary)>1')[0] == "having uses MAX(salary), which is not selected"
+
+
+def test_perform_group_by_returns_the_groups_it_prints(run, capsys):
+    make_employees()
+    groups = Mydb.perform_groupBy('employees.csv', ['department'], [('AVG', 'salary'), ('COUNT', None)],
+                                  having='COUNT()>1 OR AVG(salary)>=120000')
+    assert groups == [{'department': 'Sales', 'AVG(salary)': 120000.0, 'COUNT()': 1},
+                      {'department': 'Finance', 'AVG(salary)': 77500.0, 'COUNT()': 2}]
+    assert capsys.readouterr().out == ("Sales: AVG(salary) = 120000.0, COUNT() = 1\n"
+                                       "Finance: AVG(salary) = 77500.0, COUNT() = 2\n")
+    assert len(Mydb.perform_groupBy('employees.csv', ['department'], [('MIN', 'salary')])) == 5
@@ -0,0 +1,63 @@
+import ast
+
+import MydbIndex
+from MydbTombstone import dead_spans
+
+
+def rows_by_index(filename, column):
+    # key -> rows the index points to, skipping deleted ones
+    _, _, _, keys, offsets = MydbIndex.load_index(filename, column)
+    dead = {offset for offset, _ in dead_spans(filename)}
+    found = {}
+    with open(filename, 'rb') as file:
+        for key, offset in zip(keys, offsets):
+            if offset not in dead:
+                found.setdefault(str(key), []).append(MydbIndex.read_record_at(file, offset)[0])
+    return found
+
+
+def live_rows(run):
+    output = run('select id,name,age from people')[1]
+    return [ast.literal_eval(line) for line in output.splitlines()]
+
+
+def assert_index_matches_table(run):
+    expected = {}
+    for row in live_rows(run):
+        expected.setdefault(row['age'], []).append([row['id'], row['name'], row['age']])
+    found = rows_by_index('people.csv', 'age')
+    assert {key: sorted(rows) for key, rows in found.items()} == {key: sorted(rows) for key, rows in expected.items()}
+
+
+def test_index_follows_inserts_and_deletes(run):
+    run('create_table people id,name,age')
+    run('insert_into people ' + ';'.join(f'id={i},name=p{i},age={20 + i % 7}' for i in range(1, 201)))
+    assert run('create_index people age')[0] == "Index created on people.csv(age) with 200 entries."
+    assert_index_matches_table(run)
+
+    run('insert_into people id=201,name=late,age=22')
+    run('insert_into people id=202,name=later,age=99')
+    assert_index_matches_table(run)
+    assert run('select id from people where age==99')[1] == "{'id': '202'}\n"
+
+    # A few deletes leave tombstones; deleting most rows compacts the table, which
+    # moves the records the index points to
+    run('delete from people where id==5')
+    assert_index_matches_table(run)
+    run('delete from people where id>40')
+    assert_index_matches_table(run)
+    assert run('select id from people where age==22')[1] == (
+        "{'id': '2'}\n{'id': '9'}\n{'id': '16'}\n{'id': '23'}\n{'id': '30'}\n{'id': '37'}\n")
+
+
+def test_index_lookup_operators(run):
+    run('create_table people id,name,age:int')
+    run('insert_into people ' + ';'.join(f'id={i},name=p{i},age={i}' for i in range(1, 101)))
+    run('create_index people age')
+    for operator, value, expected in (('==', '7', [7]), ('<', '3', [1, 2]), ('<=', '2', [1, 2]),
+                                      ('>', '98', [99, 100]), ('>=', '99', [99, 100])):
+        offsets = MydbIndex.index_lookup('people.csv', 'age', operator, value)
+        rows = MydbIndex.read_rows_at('people.csv', offsets)
+        assert sorted(int(row[2]) for row in rows) == expected, operator
+        output = run(f'select id from people where age{operator}{value}')[1]
+        assert sorted(int(ast.literal_eval(line)['id']) for line in output.splitlines()) == expected, operator
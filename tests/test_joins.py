@@ -0,0 +1,92 @@
+import os
+from collections import Counter
+
+import Mydb
+from conftest import write_table, read_rows
+
+
+def make_tables(rows=300, keys=97, c_rows=None):
+    # a, b and c hold rows rows (c c_rows if given) with ids cycling through keys values
+    for table, column, count in (('a', 'x', rows), ('b', 'y', rows), ('c', 'z', c_rows or rows)):
+        write_table(f"{table}.csv", ['id', column], [(i % keys, f"{table}{i}") for i in range(count)])
+
+
+def expected_joined_rows(*tables):
+    # The rows of a join of the tables on id, computed with a nested loop
+    joined = [[]]
+    for table in tables:
+        rows = read_rows(f"{table}.csv")
+        joined = [left + right for left in joined for right in rows if not left or left[0] == right[0]]
+    return Counter(map(tuple, joined))
+
+
+def test_three_table_grace_join(run, monkeypatch):
+    # Every join of the plan is over budget; c is the larger side of the upper join,
+    # so it partitions by the estimated size of the joined rows below it
+    make_tables(keys=300, c_rows=3000)
+    monkeypatch.setattr(Mydb, 'JOIN_MEMORY_BUDGET', 2000)
+    command = 'select a.id from a join b on a.id==b.id join c on b.id==c.id'
+    assert 'grace c' in run('explain ' + command)[0]
+    assert run(command)[0] == "Select query executed."
+    assert Counter(map(tuple, read_rows('a_b_c.csv'))) == expected_joined_rows('a', 'b', 'c')
+
+
+def test_explain_join_with_order_by_is_one_tree(run):
+    make_tables()
+    for clause in ('ORDER_BY a.x LIMIT 3', 'LIMIT 3', 'ORDER_BY a.x'):
+        lines = run(f'explain analyze select a.x,b.y from a join b on a.id==b.id {clause}')[0].splitlines()
+        operators = lines[:-1]
+        assert lines[-1] == "Select query executed."
+        assert [line for line in operators if not line.startswith(' ')] == operators[:1]
+        assert operators[1].lstrip().startswith('-> Join')
+        # The join passes its rows to the sort or limit above it
+        assert 'rows in=-' not in operators[0]
+
+
+def test_joined_rows_print_as_dicts(run):
+    make_tables(rows=3)
+    output = run('select a.x from a join b on a.id==b.id where a.id==1')[1]
+    assert output == "Joined {'a.id': '1', 'a.x': 'a1', 'b.id': '1', 'b.y': 'b1'}\n"
+
+
+def test_join_methods_agree(run):
+    make_tables(rows=200, keys=50)
+    run('create_index b id')
+    where = Mydb.parse_conditions('b.y!=b7 AND a.x!=a8')[0]
+    left, right, where_predicate, _ = Mydb.prepare_join('a', 'b', 'a.id==b.id', where)
+    expected = Counter(row for row in expected_joined_rows('a', 'b') if row[3] != 'b7' and row[1] != 'a8')
+    budget = 500
+    joins = {
+        'hash': lambda: Mydb.hash_join_rows(left, right, where_predicate),
+        'grace': lambda: Mydb.grace_join_rows(left, right, where_predicate, budget),
+        'merge': lambda: Mydb.merge_join_rows(left, right, where_predicate, True, True, budget),
+        'nested_loop': lambda: Mydb.nested_loop_join_rows(left, right, where_predicate, False, budget),
+        'index_nested_loop': lambda: Mydb.nested_loop_join_rows(left, right, where_predicate, True, budget),
+    }
+    for method, join in joins.items():
+        fieldnames, rows = join()
+        assert fieldnames == ['a.id', 'a.x', 'b.id', 'b.y'], method
+        assert Counter(map(tuple, rows)) == expected, method
+
+
+def test_perform_join_functions_write_the_same_file(run):
+    make_tables(rows=200, keys=50)
+    expected = expected_joined_rows('a', 'b')
+    for perform in (lambda: Mydb.perform_hash_join(None, 'a', 'b', 'a.id==b.id', None),
+                    lambda: Mydb.perform_grace_hash_join(None, 'a', 'b', 'a.id==b.id', None, memory_budget=500),
+                    lambda: Mydb.perform_nested_loop_join(None, 'a', 'b', 'a.id==b.id', None),
+                    lambda: Mydb.perform_joins(['a', 'b'], ['a.id==b.id'], memory_budget=500)):
+        perform()
+        assert Counter(map(tuple, read_rows('a_b.csv'))) == expected
+        os.remove('a_b.csv')
+
+
+def test_join_where_and_self_join(run):
+    make_tables(rows=30, keys=10)
+    run('select a.x,b.y from a join b on a.id==b.id where a.id<3 AND b.y!=b1 ORDER_BY b.y,a.x')
+    expected = sorted((row[1], row[3]) for row in expected_joined_rows('a', 'b')
+                      if int(row[0]) < 3 and row[3] != 'b1')
+    expected.sort(key=lambda row: (row[1], row[0]))
+    assert [tuple(row) for row in read_rows('order_by_result.csv')] == expected
+    assert run('select a.id from a join a on a.id==a.id where a.id==1')[0] == "Select query executed."
+    assert len(read_rows('a_a.csv')) == 9
@@ -0,0 +1,44 @@
+import json
+
+import Mydb
+import MydbCatalog
+from conftest import write_table, read_rows
+
+
+def test_load_csv_and_jsonl(run):
+    run('create_table t id:int,name,age:int')
+    write_table('a.csv', ['name', 'id'], [('x', 1), ('y', 2)])
+    with open('b.jsonl', 'w') as file:
+        file.write(json.dumps({'id': 3, 'name': 'z', 'age': 30}) + '\n\n' + json.dumps({'id': 4, 'age': None}) + '\n')
+    assert run('load t a.csv')[0] == "Loaded 2 rows into t.csv."
+    assert run('load t b.jsonl')[0] == "Loaded 2 rows into t.csv."
+    assert read_rows('t.csv') == [['1', 'x', ''], ['2', 'y', ''], ['3', 'z', '30'], ['4', '', '']]
+    assert MydbCatalog.table_stats('t.csv')["rows"] == 4
+
+
+def test_failed_load_leaves_the_table_as_it_was(run, monkeypatch):
+    run('create_table t id:int,age:int')
+    run('insert_into t id=1,age=10')
+    # The bad row comes after a full batch has been written
+    monkeypatch.setattr(Mydb, 'LOAD_BATCH_ROWS', 3)
+    write_table('bad.csv', ['id', 'age'], [(i, i) for i in range(2, 9)] + [(9, 'old')])
+    write_table('unknown.csv', ['id', 'bogus'], [(1, 2)])
+    assert run('load t bad.csv')[0] == "Invalid int value for column age: old"
+    assert run('load t unknown.csv')[0] == "Unknown columns in unknown.csv: bogus"
+    assert run('load t missing.csv')[0] == "File missing.csv doesn't exists."
+    assert run('load nope bad.csv')[0] == "Table nope.csv doesn't exists."
+    with open('c.txt', 'w'):
+        pass
+    assert run('load t c.txt')[0] == "load expects a .csv or .jsonl file"
+    assert read_rows('t.csv') == [['1', '10']]
+    assert run('select id from t where age>0')[1] == "{'id': '1'}\n"
+
+
+def test_multi_row_insert(run, monkeypatch):
+    run('create_table t id:int,name')
+    assert run('insert_into t id=1,name=a;id=2;name=c,id=3')[0] == "3 rows inserted into t.csv."
+    assert run('insert_into t id=4;id=x')[0] == "Invalid int value for column id: x"
+    monkeypatch.setattr(Mydb, 'LOAD_BATCH_ROWS', 4)
+    run('insert_into t ' + ';'.join(f'id={i}' for i in range(10, 20)))
+    assert read_rows('t.csv') == [['1', 'a'], ['2', ''], ['3', 'c']] + [[str(i), ''] for i in range(10, 20)]
+    assert MydbCatalog.table_stats('t.csv')["rows"] == 13
@@ -0,0 +1,39 @@
+import Mydb
+import MydbZonemap
+from conftest import write_table, read_rows
+
+QUERIES = [
+    'select id,name from people where age>=60 AND id!=7',
+    'select id from people where name==p3 OR age<21',
+    'select id,age from people where id>1500 ORDER_BY age DESC,id LIMIT 20',
+    'select age,COUNT(),SUM(id),MIN(id),MAX(id),AVG(id),COUNT(DISTINCT name) from people group_by age',
+    'select age,COUNT() from people where id<1000 group_by age having COUNT()>20',
+]
+
+
+def run_all(run):
+    # What each query returned and printed, and the rows ORDER_BY wrote
+    results = []
+    for query in QUERIES:
+        results.append(run(query))
+        if 'ORDER_BY' in query:
+            results.append(read_rows('order_by_result.csv'))
+    return results
+
+
+def test_parallel_scans_match_the_serial_ones(run, monkeypatch):
+    # Small blocks, so each of the three workers gets several parts of the table
+    monkeypatch.setattr(MydbZonemap, 'ZONEMAP_BLOCK_ROWS', 100)
+    write_table('people.csv', ['id', 'name', 'age'],
+                [(i, f"p{i % 10}", '' if i % 17 == 0 else 20 + i % 50) for i in range(1, 2001)])
+    run('delete from people where id>=300 AND id<310')
+    serial = run_all(run)
+    assert "SeqScan" in run('explain ' + QUERIES[0])[0]
+
+    monkeypatch.setattr(Mydb, 'SCAN_WORKERS', 3)
+    monkeypatch.setattr(Mydb, 'PARALLEL_MIN_BYTES', 0)
+    assert run_all(run) == serial
+    assert "ParallelScan" in run('explain ' + QUERIES[0])[0]
+    assert run('explain ' + QUERIES[3])[0].startswith("ParallelHashAggregate")
+    cursor = Mydb.query('people.csv', ['id'], Mydb.parse_conditions('id>1990')[0])
+    assert [row['id'] for row in cursor] == [str(i) for i in range(1991, 2001)]
@@ -0,0 +1,63 @@
+import Mydb
+import MydbPlanner
+from conftest import write_table, read_rows
+
+
+def make_tables():
+    # sorted and sorted2 are in id order, shuffled holds the same ids out of order,
+    # small has 20 of them and names joins on text keys
+    write_table('sorted.csv', ['id', 'v'], [(i, f"v{i}") for i in range(5000)])
+    write_table('sorted2.csv', ['id', 'w'], [(i, f"w{i}") for i in range(5000)])
+    write_table('shuffled.csv', ['id', 'x'], [((i * 7919) % 5000, f"x{i}") for i in range(5000)])
+    write_table('small.csv', ['id', 's'], [(i * 50, f"s{i}") for i in range(20)])
+    write_table('names.csv', ['name', 'x'], [(f"n{i * 7 % 300}", i) for i in range(300)])
+    write_table('names2.csv', ['name', 'y'], [(f"n{i}", i) for i in range(300)])
+
+
+def plan(edges, conditions=None, memory_budget=64 * 1024 * 1024):
+    tables = {}
+    for table1, _, table2, _ in edges:
+        for table in (table1, table2):
+            tables[table] = (f"{table}.csv", (conditions or {}).get(table))
+    return MydbPlanner.plan_joins(tables, edges, memory_budget)
+
+
+def test_join_method_follows_the_tables(run):
+    make_tables()
+    # Both sides already in key order: merged without sorting
+    merge = plan([('sorted', 'id', 'sorted2', 'id')])
+    assert MydbPlanner.plan_text(merge) == "(sorted merge sorted2)"
+    assert not merge["sort_left"] and not merge["sort_right"]
+    # Unordered keys: a hash join building on the smaller side
+    hashed = plan([('sorted', 'id', 'small', 'id')])
+    assert (MydbPlanner.plan_text(hashed), hashed["build_left"]) == ("(sorted hash small)", False)
+    assert MydbPlanner.plan_text(plan([('names', 'name', 'names2', 'name')])) == "(names hash names2)"
+    # Over the memory budget the hash join partitions
+    assert MydbPlanner.plan_text(plan([('names', 'name', 'names2', 'name')], memory_budget=1000)) == (
+        "(names grace names2)")
+    # A few outer rows probe the inner table's index
+    run('create_index shuffled id')
+    selective = plan([('names', 'x', 'shuffled', 'id')], {'names': Mydb.parse_conditions('name==n5')[0]})
+    assert MydbPlanner.plan_text(selective) == "(names index_nested_loop shuffled)"
+
+
+def test_join_order_starts_from_the_smallest_result(run):
+    make_tables()
+    run('create_index shuffled id')
+    edges = [('sorted', 'id', 'shuffled', 'id'), ('shuffled', 'id', 'small', 'id')]
+    assert MydbPlanner.plan_text(plan(edges)) == "((small index_nested_loop shuffled) hash sorted)"
+    command = 'select sorted.v from sorted join shuffled on sorted.id==shuffled.id join small on shuffled.id==small.id'
+    assert "((small index_nested_loop shuffled) hash sorted)" in run('explain ' + command)[0]
+    assert run(command)[0] == "Select query executed."
+    rows = read_rows('sorted_shuffled_small.csv')
+    assert sorted(int(row[0]) for row in rows) == [i * 50 for i in range(20)]
+    assert all(row[0] == row[2] == row[4] for row in rows)
+
+
+def test_access_path_follows_selectivity(run):
+    make_tables()
+    run('create_index shuffled id')
+    assert MydbPlanner.plan_access('shuffled.csv', Mydb.parse_conditions('id==5')[0])["path"] == "index"
+    assert MydbPlanner.plan_access('shuffled.csv', Mydb.parse_conditions('id>5')[0])["path"] == "seq"
+    assert MydbPlanner.plan_access('sorted.csv', Mydb.parse_conditions('id>4900')[0])["path"] == "zonemap"
+    assert 'IndexScan' in run('explain select x from shuffled where id==5')[0]
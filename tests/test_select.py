@@ -0,0 +1,29 @@
+import Mydb
+from conftest import write_table, read_rows
+
+
+def make_employees():
+    write_table('employees.csv', ['id', 'name', 'department', 'salary'],
+                [(1, 'Alice', 'HR', 100000), (2, 'Bob', 'Sales', 120000), (3, 'Charlie', 'IT', 80000)])
+
+
+def test_select_projects_the_named_columns(run):
+    make_employees()
+    assert run('select * from employees where id<3')[1] == (
+        "{'id': '1', 'name': 'Alice', 'department': 'HR', 'salary': '100000'}\n"
+        "{'id': '2', 'name': 'Bob', 'department': 'Sales', 'salary': '120000'}\n")
+    assert run('select salary,name from employees where id==3')[1] == "{'salary': '80000', 'name': 'Charlie'}\n"
+    run('select name from employees ORDER_BY salary DESC')
+    with open('order_by_result.csv') as file:
+        assert file.read() == "name\nBob\nAlice\nCharlie\n"
+    run('select * from employees ORDER_BY salary')
+    assert [row[0] for row in read_rows('order_by_result.csv')] == ['3', '1', '2']
+    cursor = Mydb.query('employees.csv', ['name'], Mydb.parse_conditions('id>1')[0])
+    assert cursor.fetchall() == [{'name': 'Bob'}, {'name': 'Charlie'}]
+
+
+def test_unknown_columns_are_reported(run):
+    make_employees()
+    assert run('select id,nme from employees') == ("Unknown column: nme", "")
+    assert run('select nme from employees ORDER_BY id')[0] == "Unknown column: nme"
+    assert run('select id from employees where nme==1')[0] == "Unknown column: nme"
@@ -0,0 +1,63 @@
+import os
+import random
+import tempfile
+
+import Mydb
+import MydbSort
+from conftest import write_table, read_rows
+
+
+def make_table():
+    # k mixes numbers, empty cells (0) and text, which sorts after every number
+    write_table('t.csv', ['id', 'k', 'name'],
+                [(i, (i * 37) % 101 if i % 9 else ('' if i % 2 else 'x'), f"n{i % 13}") for i in range(1, 501)])
+
+
+def reference(key_descending_pairs):
+    # The rows of t sorted by Python on Mydb.sort_value, one stable pass per key
+    rows = read_rows('t.csv')
+    for position, descending in reversed(key_descending_pairs):
+        rows.sort(key=lambda row: Mydb.sort_value(row[position]), reverse=descending)
+    return rows
+
+
+def sort_dirs():
+    return {name for name in os.listdir(tempfile.gettempdir()) if name.startswith('mydb_sort_')}
+
+
+def test_external_sort_merges_spilled_runs(monkeypatch):
+    # Runs of a few rows each, merged in more than one pass
+    monkeypatch.setattr(MydbSort, 'SORT_MAX_FANIN', 3)
+    rows = [[str(random.Random(i).randint(0, 50)), f"r{i}"] for i in range(300)]
+    before = sort_dirs()
+    result = list(MydbSort.external_sort(iter(rows), lambda row: (int(row[0]), row[1]), memory_budget=1000))
+    assert result == sorted(rows, key=lambda row: (int(row[0]), row[1]))
+    assert sort_dirs() == before
+
+
+def test_order_by_over_the_memory_budget(run, monkeypatch):
+    make_table()
+    monkeypatch.setattr(MydbSort, 'SORT_MEMORY_BUDGET', 3000)
+    run('select id,k,name from t ORDER_BY k DESC,id')
+    assert read_rows('order_by_result.csv') == reference([(1, True), (0, False)])
+    run('select id,k,name from t ORDER_BY name,k')
+    assert read_rows('order_by_result.csv') == reference([(2, False), (1, False)])
+    assert 'spilled=0 B' not in run('explain analyze select id from t ORDER_BY k')[0].splitlines()[0]
+
+
+def test_limit_and_offset_keep_a_bounded_top_n(run, monkeypatch):
+    make_table()
+
+    def write_run(rows, path):
+        raise AssertionError("top-N spilled a run")
+
+    monkeypatch.setattr(MydbSort, 'write_run', write_run)
+    monkeypatch.setattr(MydbSort, 'SORT_MEMORY_BUDGET', 3000)
+    expected = reference([(1, True), (0, False)])
+    for limit, offset in ((5, 0), (5, 2), (1, 499), (10, 495), (3, 600)):
+        run(f'select id,k,name from t ORDER_BY k DESC,id LIMIT {limit} OFFSET {offset}')
+        assert read_rows('order_by_result.csv') == expected[offset:offset + limit], (limit, offset)
+    plan = run('explain analyze select id from t ORDER_BY k LIMIT 5 OFFSET 2')[0]
+    assert plan.startswith("TopNSort (k; keeps 7 rows)  rows in=500 out=5")
+    # Without ORDER_BY the first rows in table order are printed
+    assert run('select id from t LIMIT 2 OFFSET 3')[1] == "{'id': '4'}\n{'id': '5'}\n"
@@ -0,0 +1,139 @@
+import Mydb
+import MydbStatements
+from conftest import write_table, read_rows
+
+
+def make_emp(run):
+    write_table('emp.csv', ['id', 'name', 'dept', 'salary'],
+                [(i, f"n{i}", 'HR' if i % 3 else 'IT', 1000 * i) for i in range(1, 31)])
+
+
+def cached_texts():
+    return list(MydbStatements.STATEMENT_CACHE)
+
+
+def test_prepare_and_execute(run):
+    make_emp(run)
+    assert run('prepare by_id as select id,name from emp where id==?')[0] == "Prepared by_id with 1 parameter."
+    assert run('execute by_id 7') == ("Select query executed.", "{'id': '7', 'name': 'n7'}\n")
+    assert run('execute by_id 8')[1] == "{'id': '8', 'name': 'n8'}\n"
+    assert run('prepare top as select name from emp where dept==? AND salary>? ORDER_BY salary DESC LIMIT 2')[0] == (
+        "Prepared top with 2 parameters.")
+    run('execute top IT 20000')
+    run('select name from emp where dept==IT AND salary>20000 ORDER_BY salary DESC LIMIT 2')
+    with open('order_by_result.csv') as file:
+        direct = file.read()
+    run('execute top IT 20000')
+    with open('order_by_result.csv') as file:
+        assert file.read() == direct
+    # Executing does not change the shared parsed statement
+    assert run('execute by_id 9')[1] == "{'id': '9', 'name': 'n9'}\n"
+
+
+def test_prepare_and_execute_errors(run):
+    make_emp(run)
+    assert run('prepare by_id as select id from missing where id==?')[0] == "Table missing.csv doesn't exists."
+    assert run('prepare by_id select id from emp')[0] == "Invalid prepare command format"
+    assert run('execute nothing 1')[0] == "No prepared statement named nothing"
+    run('prepare by_id as select id from emp where id==? OR dept==?')
+    assert run('execute by_id 1')[0] == "Expected 2 parameters, got 1"
+    assert run('execute by_id 1 IT HR')[0] == "Expected 2 parameters, got 3"
+    assert run('prepare all as select id from emp where id<3')[0] == "Prepared all with 0 parameters."
+    assert run('execute all')[1] == "{'id': '1'}\n{'id': '2'}\n"
+
+
+def test_statements_are_cached_by_normalized_text(run):
+    make_emp(run)
+    run('select id from emp where id==1')
+    run('select  id   from emp   where id==1')
+    assert cached_texts() == ['id from emp where id==1']
+    run('prepare by_id as select   id from emp where id==?')
+    assert cached_texts() == ['id from emp where id==1', 'id from emp where id==?']
+
+
+def test_cache_forgets_statements_of_changed_tables(run):
+    make_emp(run)
+    write_table('other.csv', ['id'], [(1,)])
+    run('prepare by_id as select id,name from emp where id==?')
+    run('select id from other')
+    assert len(cached_texts()) == 2
+
+    assert run('create_index emp id')[0].startswith("Index created")
+    assert cached_texts() == ['id from other']
+    assert run('execute by_id 5')[1] == "{'id': '5', 'name': 'n5'}\n"
+
+    assert run('convert emp columnar')[0] == "Converted emp.csv to columnar (30 rows)."
+    assert cached_texts() == ['id from other']
+    assert run('execute by_id 6')[1] == "{'id': '6', 'name': 'n6'}\n"
+
+    run('select id from fresh')
+    assert 'id from fresh' in cached_texts()
+    run('create_table fresh id,name')
+    assert 'id from fresh' not in cached_texts()
+
+
+def test_explain_execute(run):
+    make_emp(run)
+    run('prepare by_dept as select dept,COUNT() from emp where salary>? group_by dept')
+    lines = run('explain analyze execute by_dept 15000')[0].splitlines()
+    assert 'HashAggregate' in lines[0]
+    assert lines[-1] == "Select query executed."
+    assert run('explain execute missing 1')[0] == "No prepared statement named missing"
+
+
+def counting(monkeypatch, name):
+    # Counts the calls Mydb makes to one of the planner's functions
+    calls = []
+    planner = getattr(Mydb, name)
+    monkeypatch.setattr(Mydb, name, lambda *args: calls.append(args) or planner(*args))
+    return calls
+
+
+def test_executions_reuse_the_chosen_plan(run, monkeypatch):
+    write_table('emp.csv', ['id', 'name', 'salary'], [(i, f"n{i}", 10 * i) for i in range(1, 2001)])
+    run('create_index emp id')
+    planned = counting(monkeypatch, 'plan_access')
+    run('prepare by_id as select id,name from emp where id==?')
+    assert run('execute by_id 7')[1] == "{'id': '7', 'name': 'n7'}\n"
+    assert "IndexScan" in run('explain execute by_id 8')[0]
+    # The index plan is used with the values of each execution
+    assert run('execute by_id 9')[1] == "{'id': '9', 'name': 'n9'}\n"
+    assert run('execute by_id x')[1] == ""
+    assert len(planned) == 1
+
+    # A write to the table plans again, as does a new index
+    run('insert_into emp id=2001,name=last,salary=1')
+    assert run('execute by_id 2001')[1] == "{'id': '2001', 'name': 'last'}\n"
+    assert len(planned) == 2
+    run('create_index emp salary')
+    assert 'id,name from emp where id==?' not in MydbStatements.PLAN_CACHE
+    run('execute by_id 5')
+    assert len(planned) == 3
+
+    # An index plan whose value the index cannot answer scans the table
+    run('prepare above as select id from emp where id>? AND salary>?')
+    assert run('execute above 1995 0')[1] == "".join(f"{{'id': '{i}'}}\n" for i in range(1996, 2002))
+    assert run('execute above x 19990') == run('select id from emp where id>x AND salary>19990')
+    # Plain selects are planned every time
+    count = len(planned)
+    run('select id from emp where id==3')
+    run('select id from emp where id==3')
+    assert len(planned) == count + 2
+
+
+def test_executions_reuse_the_join_plan(run, monkeypatch):
+    write_table('emp.csv', ['id', 'name', 'dept'], [(i, f"n{i}", f"d{i % 5}") for i in range(1, 101)])
+    write_table('dept.csv', ['name', 'floor'], [(f"d{i}", i) for i in range(5)])
+    planned = counting(monkeypatch, 'plan_joins')
+
+    def staff(value):
+        run(f'execute staff {value}')
+        return [row[0] for row in read_rows('emp_dept.csv')]
+
+    run('prepare staff as select emp.name,dept.floor from emp join dept on emp.dept==dept.name where emp.id<?')
+    assert staff(4) == ['1', '2', '3']
+    assert staff(3) == ['1', '2']
+    assert len(planned) == 1
+    run('delete from dept where floor==2')
+    assert staff(3) == ['1']
+    assert len(planned) == 2
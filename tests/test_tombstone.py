@@ -0,0 +1,102 @@
+import os
+import ast
+
+import Mydb
+import MydbIndex
+import MydbZonemap
+from MydbTombstone import tombstone_filename
+from conftest import write_table, read_rows
+
+
+def make_people(run, monkeypatch, rows=1000):
+    # Small zone map blocks so a delete spans several of them
+    monkeypatch.setattr(MydbZonemap, 'ZONEMAP_BLOCK_ROWS', 100)
+    write_table('people.csv', ['id', 'name', 'age'], [(i, f"p{i}", 20 + i % 50) for i in range(1, rows + 1)])
+    run('create_index people id')
+    run('select id from people where id>990')
+
+
+def selected_ids(run, where):
+    output = run(f'select id from people where {where}')[1]
+    return sorted(int(ast.literal_eval(line)['id']) for line in output.splitlines())
+
+
+def assert_zonemap_matches_table():
+    # The maintained zone map is still current, its blocks cover the records after
+    # the header back to back and their bounds hold every row in them
+    zonemap = MydbZonemap.load_zonemap('people.csv', build=False)
+    assert zonemap is not None
+    with open('people.csv', 'rb') as file:
+        data = file.read()
+    position = data.index(b'\n') + 1
+    rows = []
+    for block in zonemap["blocks"]:
+        assert block["start"] == position
+        cells = [line.split(',') for line in data[block["start"]:block["end"]].decode().splitlines()]
+        assert len(cells) == block["rows"]
+        for zone, values in zip(block["zones"], zip(*cells)):
+            assert zone[2] <= min(values) <= max(values) <= zone[3]
+            if zone[0] is not None:
+                assert zone[0] <= min(map(float, values)) <= max(map(float, values)) <= zone[1]
+        rows.extend(cells)
+        position = block["end"]
+    assert position == len(data)
+    assert rows == read_rows('people.csv')
+
+
+def assert_index_matches_table():
+    # Every live row is in the index exactly once, under its own id
+    _, _, _, keys, offsets = MydbIndex.load_index('people.csv', 'id')
+    with open('people.csv', 'rb') as file:
+        indexed = sorted((int(key), int(MydbIndex.read_record_at(file, offset)[0][0]))
+                         for key, offset in zip(keys, offsets))
+    ids = [int(row[0]) for row in read_rows('people.csv')]
+    assert indexed == [(i, i) for i in sorted(ids)]
+
+
+def test_deletes_leave_tombstones_until_compacted(run, monkeypatch):
+    make_people(run, monkeypatch)
+    run('delete from people where id>=150 AND id<=160')
+    run('delete from people where id==420')
+    assert os.path.exists(tombstone_filename('people.csv'))
+    assert len(read_rows('people.csv')) == 1000
+    assert selected_ids(run, 'id>=148 AND id<=162') == [148, 149, 161, 162]
+    assert selected_ids(run, 'id==420') == []
+
+    assert run('compact people')[0] == "Compacted people.csv (12 deleted rows removed)."
+    assert not os.path.exists(tombstone_filename('people.csv'))
+    assert len(read_rows('people.csv')) == 988
+    assert_zonemap_matches_table()
+    assert_index_matches_table()
+    assert selected_ids(run, 'id>=148 AND id<=162') == [148, 149, 161, 162]
+    assert selected_ids(run, 'id>995') == [996, 997, 998, 999, 1000]
+
+
+def test_large_delete_compacts_and_keeps_zonemap_and_index(run, monkeypatch):
+    make_people(run, monkeypatch)
+    run('delete from people where id>=50 AND id<=60')
+    # Leaves more than COMPACT_DEAD_FRACTION of the rows dead across several blocks
+    assert 'Compacting people.csv' in run('delete from people where id>250 AND id<=600')[1]
+    assert not os.path.exists(tombstone_filename('people.csv'))
+    ids = [i for i in range(1, 1001) if not 50 <= i <= 60 and not 250 < i <= 600]
+    assert [int(row[0]) for row in read_rows('people.csv')] == ids
+    assert_zonemap_matches_table()
+    assert_index_matches_table()
+
+    # Zone map skipping and index lookups find the rows at their new offsets
+    assert MydbZonemap.skips_blocks('people.csv', Mydb.parse_conditions('id>900')[0])
+    assert selected_ids(run, 'id>900') == list(range(901, 1001))
+    assert selected_ids(run, 'id==601') == [601]
+    assert selected_ids(run, 'age==20') == [i for i in ids if i % 50 == 0]
+    run('insert_into people id=1001,name=late,age=20')
+    assert_zonemap_matches_table()
+    assert selected_ids(run, 'id>=1000') == [1000, 1001]
+
+
+def test_malformed_delete_is_reported(run):
+    write_table('people.csv', ['id', 'name', 'age'], [(1, 'p1', 20)])
+    assert run('delete from people where age==') == ("Incomplete condition in where clause: age ==", "")
+    assert run('delete from people where (age==20')[0] == "Missing ')' in where clause"
+    assert read_rows('people.csv') == [['1', 'p1', '20']]
+    assert "'CMP'" not in run('delete from people where age==20')[1]
+    assert read_rows('people.csv') == []
@@ -0,0 +1,57 @@
+import ast
+
+from conftest import read_rows
+
+
+def make_typed_table(run):
+    assert run('create_table t id:int,price:float,name:str,born:date,note')[0] == (
+        "Table t.csv created with columns id, price, name, born, note.")
+    run('insert_into t id=007,price=2.50,name=b,born=2020-01-05,note=10')
+    run('insert_into t id=10,price=1e1,name=a,born=2019-12-31,note=9')
+    run('insert_into t id=,name=,note=')
+
+
+def ids(run, where):
+    output = run(f'select id from t where {where}')[1]
+    return [ast.literal_eval(line)['id'] for line in output.splitlines()]
+
+
+def test_typed_values_are_checked_and_stored_canonically(run):
+    assert run('create_table u id:bogus')[0] == "Unknown type bogus for column id, expected one of int, float, str, date"
+    make_typed_table(run)
+    assert run('insert_into t id=x')[0] == "Invalid int value for column id: x"
+    assert run('insert_into t id=1,price=abc')[0] == "Invalid float value for column price: abc"
+    assert run('insert_into t id=1,born=2021-02-30')[0] == "Invalid date value for column born: 2021-02-30"
+    run('select id from t')
+    assert read_rows('t.csv') == [['7', '2.5', 'b', '2020-01-05', '10'], ['10', '10.0', 'a', '2019-12-31', '9'],
+                                  ['', '', '', '', '']]
+
+
+def test_typed_columns_compare_as_their_type(run):
+    make_typed_table(run)
+    # Numbers, not text: '10' < '8' as text
+    assert ids(run, 'id<8') == ['7']
+    assert ids(run, 'id==7.0') == ['7']
+    assert ids(run, 'id==7.5') == []
+    assert ids(run, 'id>7.5') == ['10']
+    assert ids(run, 'price==2.50') == ['7']
+    assert ids(run, 'price>=2.5') == ['7', '10']
+    assert ids(run, 'name<b') == ['10']
+    assert ids(run, 'born>2020-01-01') == ['7']
+    assert run('select id from t where id==x')[0] == "Invalid int value for column id: x"
+    # A typed NULL matches no comparison; an untyped empty cell still compares as 0
+    assert ids(run, 'price==0') == []
+    assert ids(run, 'price!=2.5') == ['10']
+    assert ids(run, 'note==0') == ['']
+    assert ids(run, 'note>9') == ['7']
+
+
+def test_indexes_and_zone_maps_agree_with_typed_comparisons(run):
+    make_typed_table(run)
+    run('insert_into t ' + ';'.join(f'id={i},price={i / 4}' for i in range(11, 400)))
+    run('create_index t id')
+    assert ids(run, 'id==007') == ['7']
+    assert ids(run, 'id==7.0') == ['7']
+    assert ids(run, 'id<=10.5 AND id>=7') == ['7', '10']
+    assert ids(run, 'price==2.50') == ['7']
+    assert ids(run, 'price>99.5') == ['399']
@@ -0,0 +1,68 @@
+import pytest
+
+import MydbVector
+from MydbColumnar import load_meta
+from conftest import write_table
+
+QUERIES = [
+    'select id,salary from {} where salary>30000 AND dept!=d1',
+    'select id,dept from {} where score<=2.5 OR dept==d3',
+    'select id,note from {} where note==note7 OR id<4',
+    'select id,grade from {} where grade!=B AND id>500',
+    'select dept,COUNT(),SUM(salary),MIN(salary),MAX(salary),AVG(salary) from {} group_by dept',
+    'select dept,grade,COUNT(),COUNT(DISTINCT salary) from {} group_by dept,grade',
+    'select dept,COUNT(),SUM(score) from {} group_by dept',
+    'select dept,COUNT(note) from {} group_by dept',
+]
+
+
+def make_tables(run):
+    # emp is a CSV table to compare against; cemp holds the same rows as columns:
+    # id and salary int (salary with empty cells), score float, dept and grade
+    # dictionary codes and note plain strings
+    rows = [(i, f"d{i % 4}", '' if i % 11 == 0 else 1000 * (i % 60), '' if i % 13 == 0 else (i % 9) / 2,
+             'ABC'[i % 3], f"note{i}" if i % 5 else '') for i in range(1, 601)]
+    for table in ('emp', 'cemp'):
+        write_table(f"{table}.csv", ['id', 'dept', 'salary', 'score', 'grade', 'note'], rows)
+    run('convert cemp columnar')
+    assert load_meta('cemp.csv')["types"] == ['int', 'dict', 'int', 'float', 'dict', 'str']
+    for table in ('emp', 'cemp'):
+        run(f'delete from {table} where id>=100 AND id<110')
+
+
+def assert_matches_csv_table(run, scan, aggregate):
+    for query in QUERIES:
+        assert run(query.format('cemp')) == run(query.format('emp')), query
+    assert f"-> {scan} (cemp.csv" in run('explain ' + QUERIES[0].format('cemp'))[0]
+    assert run('explain ' + QUERIES[4].format('cemp'))[0].startswith(aggregate)
+
+
+def test_numpy_path(run, monkeypatch):
+    pytest.importorskip('numpy')
+    # Several chunks, one of them holding the deleted rows
+    monkeypatch.setattr(MydbVector, 'VECTOR_CHUNK_ROWS', 64)
+    make_tables(run)
+    assert_matches_csv_table(run, 'VectorScan', 'VectorAggregate')
+
+
+def test_pure_python_path(run, monkeypatch):
+    monkeypatch.setattr(MydbVector, 'VECTORIZE', False)
+    make_tables(run)
+    assert_matches_csv_table(run, 'ColumnarScan', 'HashAggregate')
+
+
+@pytest.mark.parametrize('vectorize', [True, False])
+def test_typed_columnar_table_matches_typed_csv_table(run, monkeypatch, vectorize):
+    if vectorize:
+        pytest.importorskip('numpy')
+    monkeypatch.setattr(MydbVector, 'VECTORIZE', vectorize)
+    for table in ('emp', 'cemp'):
+        run(f'create_table {table} id:int,price:float,name:str,age')
+        run(f'insert_into {table} ' + ';'.join(f'id={i},price={i / 2},name=n{i % 3},age={i}' for i in range(1, 8))
+            + ';id=8,name=x,age=')
+    run('convert cemp columnar')
+    for where in ('id==1.0', 'id!=1.0', 'id==1.5', 'id>=2.5', 'id<=1.0', 'price==1.50', 'price!=0.5', 'price==0',
+                  'price<1', 'name==n1', 'age==0', 'age!=0'):
+        query = 'select id from {} where ' + where
+        assert run(query.format('cemp')) == run(query.format('emp')), where
+    assert run('select id from cemp where id==1.0')[1] == "{'id': '1'}\n"
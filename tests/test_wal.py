@@ -0,0 +1,65 @@
+import os
+import threading
+
+import Mydb
+import MydbWal
+from conftest import read_rows
+
+
+def test_append_returns_once_synced():
+    log = MydbWal.WriteAheadLog("test.wal")
+    for i in range(5):
+        log.append({"op": "insert", "rows": [[str(i)]]})
+        assert log.synced == log.written == i + 1
+    log.close()
+    assert [record["rows"] for record in MydbWal.read_wal("test.wal")] == [[[str(i)]] for i in range(5)]
+
+
+def test_concurrent_appends_share_fsyncs():
+    log = MydbWal.WriteAheadLog("test.wal")
+
+    def append(thread):
+        for i in range(50):
+            log.append({"thread": thread, "i": i})
+
+    threads = [threading.Thread(target=append, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    log.close()
+    assert log.synced == log.written == 400
+    assert log.syncs <= 400
+    assert len(list(MydbWal.read_wal("test.wal"))) == 400
+
+
+def crash():
+    # The process dies: the log stays as written, queued inserts never reach the table
+    Mydb.WAL.file.close()
+    Mydb.WAL = None
+    Mydb.PENDING_INSERTS.clear()
+
+
+def test_replay_after_crash(run):
+    run('create_table events id,name')
+    run('insert_into events id=1,name=a')
+    run('insert_into events id=2,name=b;id=3,name=c')
+    run('delete from events where id==2')
+    run('insert_into events id=4,name=d')
+    assert ['4', 'd'] not in read_rows('events.csv')
+    crash()
+    Mydb.open_wal()
+    assert read_rows('events.csv') == [['1', 'a'], ['3', 'c'], ['4', 'd']]
+    assert run('select id from events')[1] == "{'id': '1'}\n{'id': '3'}\n{'id': '4'}\n"
+
+
+def test_replay_ignores_torn_record(run):
+    run('create_table events id,name')
+    run('insert_into events id=1,name=a')
+    run('insert_into events id=2,name=b')
+    crash()
+    # The last record was cut short by the crash
+    with open(MydbWal.WAL_FILE, 'r+b') as file:
+        file.truncate(os.path.getsize(MydbWal.WAL_FILE) - 3)
+    Mydb.open_wal()
+    assert read_rows('events.csv') == [['1', 'a']]